@@ -0,0 +1,142 @@
+from argparse import ArgumentParser
+from itertools import combinations
+from utils import (
+    parse_csv,
+    CSVValidationError,
+    AVAILABLE_COURSES,
+    DEFAULT_LOCATION_DATASET_TRAIN,
+)
+import numpy as np
+import time
+
+
+def masked_scores(X):
+    """Z-scores of the columns of X with the missing scores set to zero, and the mask of present scores.
+
+    Scores differ by orders of magnitude across courses, sums of z-scores stay well conditioned.
+    """
+    present = ~np.isnan(X)
+    count = present.sum(axis=0)
+    Z = np.where(present, X, 0.0)
+    Z -= Z.sum(axis=0) / np.maximum(count, 1)
+    Z[~present] = 0.0
+    std = np.sqrt((Z * Z).sum(axis=0) / np.maximum(count, 1))
+    Z /= np.where(std > 0, std, 1)
+    return Z, present.astype(float)
+
+
+def correlation_matrix(X):
+    """Pearson correlation of every pair of columns of X, over the rows where both are present.
+
+    Without missing scores this is one matrix product of the z-scores. Missing scores are
+    masked to zero, so each pairwise sum over the rows present in both columns is one matrix
+    product too. Constant columns have NaN correlations.
+    """
+    Z, present = masked_scores(X)
+    if present.all():
+        products = Z.T @ Z
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return products / np.sqrt(np.outer(np.diag(products), np.diag(products)))
+    counts = present.T @ present
+    # sums[i, j] is the sum of column i over the rows where column j is present too
+    sums = Z.T @ present
+    squares = (Z * Z).T @ present
+    with np.errstate(invalid="ignore", divide="ignore"):
+        covariance = counts * (Z.T @ Z) - sums * sums.T
+        variance = counts * squares - sums * sums
+        return covariance / np.sqrt(variance * variance.T)
+
+
+def homogeneity_scores(X, houses):
+    """One-way ANOVA F statistic of every column of X across the house codes of its rows.
+
+    The lower the F, the closer the score distributions of the houses. Rows without a house
+    (code -1) and missing scores are left out.
+    """
+    Z, present = masked_scores(X[houses >= 0])
+    groups = np.eye(houses.max() + 1)[houses[houses >= 0]]
+
+    counts = groups.T @ present
+    sums = groups.T @ Z
+    with np.errstate(invalid="ignore", divide="ignore"):
+        explained = np.where(counts > 0, sums * sums / counts, 0).sum(axis=0)
+        n, k = counts.sum(axis=0), (counts > 0).sum(axis=0)
+        between = (explained - sums.sum(axis=0) ** 2 / n) / (k - 1)
+        within = ((Z * Z).sum(axis=0) - explained) / (n - k)
+        return between / within
+
+
+def rank_courses(df, courses=AVAILABLE_COURSES):
+    """Courses with their F statistic, the most homogeneous across houses first."""
+    houses = df["Hogwarts House"].astype("category").cat.codes.to_numpy()
+    scores = homogeneity_scores(df[courses].to_numpy(dtype=float), houses)
+    return sorted(zip(courses, scores.tolist()), key=lambda item: (np.isnan(item[1]), item[1]))
+
+
+def rank_pairs(df, courses=AVAILABLE_COURSES):
+    """Pairs of courses, in the order scatter_plot names them, with their correlation, the strongest first."""
+    courses = sorted(courses)
+    correlations = correlation_matrix(df[courses].to_numpy(dtype=float))
+    pairs = [
+        ((courses[i], courses[j]), float(correlations[i, j])) for i, j in combinations(range(len(courses)), r=2)
+    ]
+    return sorted(pairs, key=lambda item: (np.isnan(item[1]), -abs(item[1])))
+
+
+def format_rankings(ranked_courses, ranked_pairs):
+    width = max(len(" / ".join(pair)) for pair, _ in ranked_pairs) if ranked_pairs else 0
+    lines = ["Most homogeneous courses across houses (ANOVA F, lowest first):"]
+    lines += [f"{rank:>4}. {course:<{width}}  F = {score:.4f}" for rank, (course, score) in enumerate(ranked_courses, 1)]
+    lines += ["", "Most similar pairs of courses (Pearson correlation, strongest first):"]
+    lines += [
+        f"{rank:>4}. {' / '.join(pair):<{width}}  r = {correlation:+.4f}"
+        for rank, (pair, correlation) in enumerate(ranked_pairs, 1)
+    ]
+    return "\n".join(lines)
+
+
+def parse_args():
+    parser = ArgumentParser(
+        prog="analysis",
+        description="Rank the courses by how alike the houses score in them, and the pairs of courses by how correlated they are.",
+    )
+
+    parser.add_argument(
+        "path",
+        type=str,
+        nargs="?",
+        default=DEFAULT_LOCATION_DATASET_TRAIN,
+        help=f"Path to the input CSV dataset, or a directory or glob of shards. Defaults to '{DEFAULT_LOCATION_DATASET_TRAIN}' if not specified.",
+    )
+
+    parser.add_argument(
+        "--top",
+        type=int,
+        help="Only print the first courses and pairs of each ranking.",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    try:
+        df = parse_csv(args.path, columns=["Hogwarts House"] + AVAILABLE_COURSES)
+        start = time.perf_counter()
+        ranked_courses, ranked_pairs = rank_courses(df), rank_pairs(df)
+        elapsed = time.perf_counter() - start
+
+        print(format_rankings(ranked_courses[: args.top], ranked_pairs[: args.top]))
+        print(f"\nRanked {len(ranked_courses)} courses and {len(ranked_pairs)} pairs of {len(df)} students in {elapsed * 1000:.1f}ms")
+
+    except FileNotFoundError:
+        print(f"Error: File '{args.path}' not found.")
+    except CSVValidationError as ex:
+        print(f"{ex.__class__.__name__}: {ex}")
+    except Exception as ex:
+        print(f"Unexpected error occured : {ex}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+from utils import parse_csv_chunks, merge_moments
+import numpy as np
+import json
+import os
+
+
+# Out-of-core training data: a directory holding the standardized feature matrices and the
+# label vectors as raw binary files, described by meta.json, opened with np.memmap.
+DEFAULT_CHUNKSIZE = 100_000
+DEFAULT_BLOCK_ROWS = 1 << 16
+LABEL_COLUMN = "Hogwarts House"
+ARRAYS = ("X", "y", "X_val", "y_val")
+LABEL_DTYPE = np.int8
+
+
+def class_labels(found, preferred=()):
+    """Distinct labels of found, those of preferred first and in its order, then the others sorted."""
+    found = set(found)
+    return [label for label in preferred if label in found] + sorted(found - set(preferred))
+
+
+def chunk_moments(X):
+    if not len(X):
+        return 0, np.zeros(X.shape[1]), np.zeros(X.shape[1])
+    mean = X.mean(axis=0)
+    return len(X), mean, ((X - mean) ** 2).sum(axis=0)
+
+
+def standardize_in_place(X, mean, std, block_rows):
+    for start in range(0, len(X), block_rows):
+        X[start : start + block_rows] = (X[start : start + block_rows] - mean) / std
+    X.flush()
+
+
+def renumber_in_place(y, renumber, block_rows):
+    for start in range(0, len(y), block_rows):
+        y[start : start + block_rows] = renumber[y[start : start + block_rows]]
+    y.flush()
+
+
+def open_arrays(directory, meta, mode="r"):
+    shapes = {
+        "X": (meta["rows"], len(meta["features"])),
+        "y": (meta["rows"],),
+        "X_val": (meta["validation_rows"], len(meta["features"])),
+        "y_val": (meta["validation_rows"],),
+    }
+    arrays = {}
+    for name, shape in shapes.items():
+        dtype = meta["dtype"] if name.startswith("X") else LABEL_DTYPE
+        path = os.path.join(directory, f"{name}.bin")
+        # np.memmap cannot map an empty file
+        arrays[name] = np.memmap(path, dtype=dtype, mode=mode, shape=shape) if shape[0] else np.empty(shape, dtype)
+    return arrays
+
+
+def convert_to_memmap(
+    path,
+    directory,
+    features,
+    label_order=(),
+    dtype="float64",
+    chunksize=DEFAULT_CHUNKSIZE,
+    validation_split=0.0,
+    seed=None,
+    block_rows=DEFAULT_BLOCK_ROWS,
+):
+    """Stream a training dataset into memory-mapped matrices, never holding more than a chunk.
+
+    The standardization statistics are merged chunk by chunk on the raw scores, which are then
+    standardized in place. Rows are held out for validation with probability validation_split.
+    The labels are numbered as they appear, then renumbered in place in the order of class_labels.
+    Returns (X, y, labels, validation, preprocessing), validation being None without a split.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    codes = {}
+    moments = (0, np.zeros(len(features)), np.zeros(len(features)))
+    rows = {"X": 0, "X_val": 0}
+
+    files = {name: open(os.path.join(directory, f"{name}.bin"), "wb") for name in ARRAYS}
+    try:
+        for chunk in parse_csv_chunks(path, chunksize, columns=[LABEL_COLUMN] + features):
+            X = chunk[features].to_numpy(dtype=float)
+            for label in chunk[LABEL_COLUMN].unique():
+                codes.setdefault(label, len(codes))
+            if len(codes) > np.iinfo(LABEL_DTYPE).max + 1:
+                raise ValueError(f"More than {np.iinfo(LABEL_DTYPE).max + 1} classes in '{path}'.")
+            y = chunk[LABEL_COLUMN].map(codes).to_numpy(dtype=LABEL_DTYPE)
+            # Like the in-memory path, the statistics cover the validation rows too
+            moments = merge_moments(moments, chunk_moments(X))
+
+            held_out = rng.random(len(X)) < validation_split
+            for suffix, rows_mask in (("", ~held_out), ("_val", held_out)):
+                files["X" + suffix].write(X[rows_mask].astype(dtype).tobytes())
+                files["y" + suffix].write(y[rows_mask].tobytes())
+                rows["X" + suffix] += int(rows_mask.sum())
+    finally:
+        for file in files.values():
+            file.close()
+
+    count, mean, m2 = moments
+    if not rows["X"]:
+        raise ValueError(f"No complete rows to train on in '{path}'.")
+    if validation_split > 0 and not rows["X_val"]:
+        raise ValueError(f"--validation-split {validation_split} held out none of the {rows['X']} rows of '{path}'.")
+    std = np.sqrt(m2 / count)
+    labels = class_labels(codes, label_order)
+    renumber = np.array([labels.index(label) for label in codes], dtype=LABEL_DTYPE)
+
+    meta = {
+        "source": os.path.abspath(path),
+        "features": list(features),
+        "labels": list(labels),
+        "dtype": np.dtype(dtype).name,
+        "rows": rows["X"],
+        "validation_rows": rows["X_val"],
+        "mean": mean.tolist(),
+        "std": std.tolist(),
+    }
+    arrays = open_arrays(directory, meta, mode="r+")
+    for name in ("X", "X_val"):
+        if len(arrays[name]):
+            standardize_in_place(arrays[name], mean, std, block_rows)
+    if (renumber != np.arange(len(renumber))).any():
+        for name in ("y", "y_val"):
+            if len(arrays[name]):
+                renumber_in_place(arrays[name], renumber, block_rows)
+    with open(os.path.join(directory, "meta.json"), "w") as file:
+        json.dump(meta, file, indent=4)
+
+    arrays = open_arrays(directory, meta)
+    validation = (arrays["X_val"], arrays["y_val"]) if rows["X_val"] else None
+    preprocessing = {"features": list(features), "mean": mean, "std": std}
+    return arrays["X"], arrays["y"], labels, validation, preprocessing
@@ -1,62 +1,589 @@
 from argparse import ArgumentParser
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from utils import expand_paths, merge_moments, MISSING_VALUES, LEAN_READER_MAX_BYTES
+import numpy as np
+import hashlib
+import csv
+import io
+import json
+import os
+import sys
 
 
 DDOF = 1
+QUARTILES = (25, 50, 75)
+DEFAULT_QUANTILE_ACCURACY = 0.01
+DEFAULT_CACHE_CHUNKSIZE = 100_000
+CACHE_SUFFIX = ".describe-cache.json"
+FINGERPRINT_BLOCK = 1 << 20
+SKETCH_BUFFER_FACTOR = 5
+
+
+def valid(data):
+    data = np.asarray(data, dtype=float)
+    return data[~np.isnan(data)]
+
+
+def moments(values):
+    # values must already be NaN-free, see valid()
+    n = values.size
+    if n == 0:
+        return 0, np.nan, 0.0, np.nan, np.nan
+    m = np.add.reduce(values) / n
+    deviations = values - m
+    return n, m, np.dot(deviations, deviations), values.min(), values.max()
+
+
+def quantiles(values, percents=QUARTILES):
+    # Linear interpolation between closest ranks, all ranks selected with a single partition
+    n = values.size
+    if n == 0:
+        return [np.nan] * len(percents)
+    ranks = [(n - 1) * percent / 100 for percent in percents]
+    lower = [int(rank) for rank in ranks]
+    upper = [min(index + 1, n - 1) for index in lower]
+    selected = np.partition(values, sorted(set(lower + upper)))
+    return [
+        selected[lo] + (selected[up] - selected[lo]) * (rank - lo)
+        for rank, lo, up in zip(ranks, lower, upper)
+    ]
+
+
+def merge_column_moments(a, b):
+    # (count, mean, M2, min, max) of a column: the shared Chan update, then the extrema
+    if a[0] == 0:
+        return b
+    if b[0] == 0:
+        return a
+    return (*merge_moments(a[:3], b[:3]), min(a[3], b[3]), max(a[4], b[4]))
+
+
+class QuantileSketch:
+    """Bounded-memory merging digest: sorted centroids whose weights are capped by their rank.
+
+    The cap follows the t-digest k1 scale k(q) = compression / (2 pi) * asin(2q - 1): a centroid
+    spans at most one unit of k, so at most ~accuracy * n values in the middle and fewer in the tails.
+    """
+
+    def __init__(self, accuracy=DEFAULT_QUANTILE_ACCURACY):
+        self.accuracy = accuracy
+        # dq/dk peaks at pi / compression around the median
+        self.compression = int(np.ceil(np.pi / accuracy))
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+
+    def update(self, values):
+        self._compress(np.concatenate((self.means, values)), np.concatenate((self.weights, np.ones(len(values)))))
+
+    def merge(self, other):
+        self._compress(np.concatenate((self.means, other.means)), np.concatenate((self.weights, other.weights)))
+
+    def to_dict(self):
+        return {"accuracy": self.accuracy, "means": self.means.tolist(), "weights": self.weights.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["accuracy"])
+        sketch.means, sketch.weights = np.array(data["means"], dtype=float), np.array(data["weights"], dtype=float)
+        return sketch
+
+    def _rank_limit(self, q):
+        # Largest rank fraction a centroid starting at q may reach: one unit further on the k1 scale
+        angle = np.arcsin(2 * q - 1) + 2 * np.pi / self.compression
+        return 1.0 if angle >= np.pi / 2 else (np.sin(angle) + 1) / 2
+
+    def _compress(self, means, weights):
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        # Small chunks are buffered as they come, and only compressed once there are enough of them
+        if len(means) <= SKETCH_BUFFER_FACTOR * self.compression:
+            self.means, self.weights = means, weights
+            return
+        # Greedily grow each centroid while its weight stays within the cap of its rank,
+        # one binary search per output centroid rather than one step per input
+        total = weights.sum()
+        ends = np.cumsum(weights)
+        starts, start = [], 0
+        while start < len(means):
+            starts.append(start)
+            limit = self._rank_limit((ends[start] - weights[start]) / total) * total
+            start = max(int(np.searchsorted(ends, limit, side="right")), start + 1)
+        sums = np.add.reduceat(means * weights, starts)
+        weights = np.add.reduceat(weights, starts)
+        self.means, self.weights = sums / weights, weights
+
+    def quantiles(self, percents=QUARTILES):
+        total = self.weights.sum()
+        if total == 0:
+            return [np.nan] * len(percents)
+        # Centroid i covers ranks [start, start + weight - 1], its mean sits in the middle
+        centers = np.cumsum(self.weights) - (self.weights + 1) / 2
+        ranks = [(total - 1) * percent / 100 for percent in percents]
+        return list(np.interp(ranks, centers, self.means))
+
+
+def statistics(n, m, m2, minimum, maximum, quartiles):
+    variance = m2 / (n - DDOF) if n > DDOF else np.nan
+    return {
+        "Count": n,
+        "Mean": m,
+        "Std": variance**0.5,
+        "Min": minimum,
+        **{f"{percent}%": value for percent, value in zip(QUARTILES, quartiles)},
+        "Max": maximum,
+        "Var": variance,
+        "PtP": maximum - minimum,
+    }
+
+
+def describe_column(data):
+    values = valid(data)
+    return statistics(*moments(values), quantiles(values))
+
+
+def count(data):
+    return valid(data).size
 
 
 def mean(data):
-    n = count(data)
-    return sum(e for e in data if not pd.isna(e)) / n
+    return moments(valid(data))[1]
 
 
 def var(data):
-    m = mean(data)
-    n = count(data) - DDOF
-    return sum((d - m) ** 2 for d in data if not pd.isna(d)) / n
+    return statistics(*moments(valid(data)), quartiles=[])["Var"]
 
 
 def std(data):
     return var(data) ** 0.5
 
 
+def minimum(data):
+    return moments(valid(data))[3]
+
+
+def maximum(data):
+    return moments(valid(data))[4]
+
+
 def ptp(data):
-    return max(data) - min(data)
+    return maximum(data) - minimum(data)
 
 
 def percentile(percent):
     def inside(data):
-        data_sorted = sorted(e for e in data if not pd.isna(e))
-        rank = (len(data_sorted) - 1) * percent / 100
-        lower_index = int(rank)
-        upper_index = lower_index + 1
-        lower_value = data_sorted[lower_index]
-        upper_value = data_sorted[upper_index] if upper_index < len(data_sorted) else lower_value
-        quantile_value = lower_value + (upper_value - lower_value) * (rank - lower_index)
-
-        return quantile_value
+        return quantiles(valid(data), [percent])[0]
 
     return inside
 
 
-def count(data):
-    return sum(not pd.isna(e) for e in data)
-
-
 FUNCTIONS = {
     "Count": count,
     "Mean": mean,
     "Std": std,
-    "Min": min,
+    "Min": minimum,
     "25%": percentile(25),
     "50%": percentile(50),
     "75%": percentile(75),
-    "Max": max,
+    "Max": maximum,
     "Var": var,
     "PtP": ptp,
 }
 
 
+def describe_frame(data):
+    features = data.select_dtypes(include="number")
+    # del features["Index"]
+    return {feature: describe_column(features[feature].to_numpy(dtype=float)) for feature in features}
+
+
+def read_numeric_columns(path):
+    if os.path.getsize(path) > LEAN_READER_MAX_BYTES:
+        import pandas as pd
+
+        features = pd.read_csv(path).select_dtypes(include="number")
+        return {feature: features[feature].to_numpy(dtype=float) for feature in features}
+
+    # Lean reader for small files, importing pandas costs more than describing them.
+    # Like pandas, a column is numeric when every value that is not missing parses as a number.
+    with open(path, newline="") as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        columns = [[] for _ in header]
+        for row in reader:
+            if len(row) != len(header):
+                raise ValueError(f"Expected {len(header)} fields, saw {len(row)}.")
+            for column, value in zip(columns, row):
+                column.append(value)
+
+    numeric = {}
+    for name, values in zip(header, columns):
+        try:
+            numeric[name] = np.array(
+                [np.nan if value in MISSING_VALUES else float(value) for value in values], dtype=float
+            )
+        except ValueError:
+            continue
+    return numeric
+
+
+def describe_numeric_columns(path):
+    return {feature: describe_column(values) for feature, values in read_numeric_columns(path).items()}
+
+
+def describe_groups(data, by):
+    import pandas as pd
+
+    # One stable sort per feature on (group code, value) gives every group's
+    # min, max and quartiles by indexing, the moments come from bincount
+    codes, labels = pd.factorize(data[by], sort=True)
+    features = data.drop(columns=by).select_dtypes(include="number")
+    groups = len(labels)
+    groups_data = {label: {} for label in labels}
+
+    for feature in features:
+        values = features[feature].to_numpy(dtype=float)
+        mask = ~np.isnan(values) & (codes >= 0)
+        keys, values = codes[mask], values[mask]
+        values = values[np.lexsort((values, keys))]
+        keys = np.sort(keys, kind="stable")
+
+        counts = np.bincount(keys, minlength=groups)
+        starts = np.cumsum(counts) - counts
+        present = counts > 0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.bincount(keys, weights=values, minlength=groups) / counts
+            m2s = np.bincount(keys, weights=(values - means[keys]) ** 2, minlength=groups)
+
+        def at(offsets):
+            return np.where(present, values[np.where(present, starts + offsets, 0)], np.nan) if values.size else np.full(groups, np.nan)
+
+        minimums, maximums = at(0), at(counts - 1)
+        quartiles = []
+        for percent in QUARTILES:
+            ranks = (counts - 1).clip(0) * percent / 100
+            lower = ranks.astype(np.intp)
+            upper = np.minimum(lower + 1, (counts - 1).clip(0))
+            quartiles.append(at(lower) + (at(upper) - at(lower)) * (ranks - lower))
+
+        for code, label in enumerate(labels):
+            groups_data[label][feature] = statistics(
+                int(counts[code]),
+                means[code],
+                m2s[code],
+                minimums[code],
+                maximums[code],
+                [quartile[code] for quartile in quartiles],
+            )
+
+    return groups_data
+
+
+def describe_columns(path, columns):
+    import pandas as pd
+
+    return describe_frame(pd.read_csv(path, usecols=columns))
+
+
+def accumulate(chunks, accuracy, features=None):
+    accumulators = {}
+    for chunk in chunks:
+        if not accumulators:
+            if features is None:
+                features = chunk.select_dtypes(include="number")
+            accumulators = {feature: [moments(valid([])), QuantileSketch(accuracy)] for feature in features}
+        for feature, accumulator in accumulators.items():
+            values = valid(chunk[feature])
+            accumulator[0] = merge_column_moments(accumulator[0], moments(values))
+            accumulator[1].update(values)
+
+    return accumulators
+
+
+def merge_accumulators(accumulators, other):
+    for feature, (other_moments, other_sketch) in other.items():
+        if feature not in accumulators:
+            accumulators[feature] = [other_moments, other_sketch]
+            continue
+        accumulators[feature][0] = merge_column_moments(accumulators[feature][0], other_moments)
+        accumulators[feature][1].merge(other_sketch)
+
+    return accumulators
+
+
+def finalize(accumulators):
+    return {
+        feature: statistics(*accumulator[0], accumulator[1].quantiles())
+        for feature, accumulator in accumulators.items()
+    }
+
+
+def accumulate_file(path, chunksize, accuracy):
+    import pandas as pd
+
+    return accumulate(pd.read_csv(path, chunksize=chunksize), accuracy)
+
+
+def describe_stream(path, chunksize, accuracy):
+    return finalize(accumulate_file(path, chunksize, accuracy))
+
+
+def describe_shards(paths, jobs, chunksize, accuracy):
+    # The csv module holds the GIL, so shards are read by worker processes
+    with ProcessPoolExecutor(min(jobs, len(paths))) as executor:
+        if chunksize:
+            accumulators = {}
+            for other in executor.map(accumulate_file, paths, [chunksize] * len(paths), [accuracy] * len(paths)):
+                merge_accumulators(accumulators, other)
+            return finalize(accumulators)
+        shards = list(executor.map(read_numeric_columns, paths))
+
+    # Like concatenating the shards, a column missing from some of them only counts where present
+    features = dict.fromkeys(feature for shard in shards for feature in shard)
+    return {
+        feature: describe_column(np.concatenate([shard[feature] for shard in shards if feature in shard]))
+        for feature in features
+    }
+
+
+def read_shard_frames(paths, jobs):
+    import pandas as pd
+
+    with ThreadPoolExecutor(min(jobs, len(paths))) as executor:
+        return pd.concat(executor.map(pd.read_csv, paths), ignore_index=True)
+
+
+class ByteRange(io.RawIOBase):
+    """Read-only view over the next `length` bytes of an open binary file."""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.remaining)
+        read = self.file.readinto(memoryview(buffer)[:size])
+        self.remaining -= read
+        return read
+
+
+def byte_ranges(path, parts):
+    # Split the body of the file into `parts` ranges starting on a line boundary
+    # (rows containing quoted newlines are not supported)
+    with open(path, "rb") as file:
+        header = file.readline()
+        size = os.fstat(file.fileno()).st_size
+        boundaries = [len(header)]
+        for i in range(1, parts):
+            file.seek(max(len(header) + (size - len(header)) * i // parts - 1, boundaries[-1]))
+            file.readline()
+            boundaries.append(max(file.tell(), boundaries[-1]))
+        boundaries.append(size)
+
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def accumulate_range(path, columns, features, start, end, chunksize, accuracy):
+    import pandas as pd
+
+    with open(path, "rb") as file:
+        file.seek(start)
+        chunks = pd.read_csv(
+            io.BufferedReader(ByteRange(file, end - start)),
+            header=None,
+            names=columns,
+            usecols=features,
+            chunksize=chunksize,
+        )
+        return accumulate(chunks, accuracy, features)
+
+
+def complete_lines_end(path):
+    # Offset right after the last newline, a partially written last row is left for the next run
+    with open(path, "rb") as file:
+        end = os.fstat(file.fileno()).st_size
+        while end > 0:
+            start = max(end - FINGERPRINT_BLOCK, 0)
+            file.seek(start)
+            newline = file.read(end - start).rfind(b"\n")
+            if newline != -1:
+                return start + newline + 1
+            end = start
+    return 0
+
+
+def complete_tail_end(path, end, fields):
+    # End of the file when the bytes past the last newline hold a row of every field,
+    # like the last row of an export without a trailing newline, else end
+    with open(path, "rb") as file:
+        file.seek(end)
+        tail = file.read()
+    rows = list(csv.reader(io.StringIO(tail.decode(errors="replace")))) if tail.strip() else []
+    return end + len(tail) if len(rows) == 1 and len(rows[0]) == fields else end
+
+
+def fingerprint(path, end, start=0):
+    """Digests of the FINGERPRINT_BLOCK-long blocks of the file up to end, from the block holding start.
+
+    The whole prefix is hashed, any rewrite of it is caught. Hashing reads far faster than parsing,
+    and as blocks are aligned the digests of the complete blocks of a prefix can be kept when it grows.
+    """
+    digests = []
+    with open(path, "rb") as file:
+        file.seek(start - start % FINGERPRINT_BLOCK)
+        while file.tell() < end:
+            block = file.read(min(FINGERPRINT_BLOCK, end - file.tell()))
+            if not block:
+                break
+            digests.append(hashlib.blake2b(block, digest_size=16).hexdigest())
+    return digests
+
+
+def load_cache(cache_path, columns, accuracy):
+    try:
+        with open(cache_path) as file:
+            cache = json.load(file)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if cache.get("columns") != columns or cache.get("accuracy") != accuracy:
+        return None
+    return cache
+
+
+def save_cache(cache_path, columns, features, accuracy, offset, checksums, accumulators):
+    cache = {
+        "columns": columns,
+        "features": features,
+        "accuracy": accuracy,
+        "offset": offset,
+        "checksums": checksums,
+        "accumulators": {
+            feature: {"moments": [float(value) for value in accumulator[0]], "sketch": accumulator[1].to_dict()}
+            for feature, accumulator in accumulators.items()
+        },
+    }
+    try:
+        with open(cache_path + ".tmp", "w") as file:
+            json.dump(cache, file)
+        os.replace(cache_path + ".tmp", cache_path)
+    except OSError as ex:
+        # A cache that cannot be written only costs the next run a full pass, the report still goes out
+        print(f"Warning: could not write the cache of '{cache_path}': {ex}", file=sys.stderr)
+
+
+def describe_incremental(path, chunksize, accuracy):
+    import pandas as pd
+
+    columns = list(pd.read_csv(path, nrows=0).columns)
+    end = complete_lines_end(path)
+    cache_path = path + CACHE_SUFFIX
+    cache = load_cache(cache_path, columns, accuracy)
+
+    checksums = []
+    if cache and cache["offset"] <= end and fingerprint(path, cache["offset"]) == cache.get("checksums"):
+        features, start, checksums = cache["features"], cache["offset"], cache["checksums"]
+        accumulators = {
+            feature: [(int(data["moments"][0]), *data["moments"][1:]), QuantileSketch.from_dict(data["sketch"])]
+            for feature, data in cache["accumulators"].items()
+        }
+    else:
+        if cache:
+            print(f"Warning: '{path}' changed before offset {cache['offset']}, its cache is discarded.", file=sys.stderr)
+        features = list(pd.read_csv(path, nrows=chunksize).select_dtypes(include="number"))
+        with open(path, "rb") as file:
+            start = len(file.readline())
+        accumulators = {}
+
+    if start < end:
+        merge_accumulators(accumulators, accumulate_range(path, columns, features, start, end, chunksize, accuracy))
+    # Only the blocks past the last complete one already hashed are read again
+    offset = max(start, end)
+    checksums = checksums[: start // FINGERPRINT_BLOCK] + fingerprint(path, offset, start)
+    save_cache(cache_path, columns, features, accuracy, offset, checksums, accumulators)
+
+    # An unterminated last row may still be being written, it is left out of the cache
+    # and only counted in this report, on a copy of the accumulators
+    tail_end = complete_tail_end(path, offset, len(columns))
+    if tail_end > offset:
+        accumulators = {
+            feature: [accumulator[0], QuantileSketch.from_dict(accumulator[1].to_dict())]
+            for feature, accumulator in accumulators.items()
+        }
+        tail = accumulate_range(path, columns, features, offset, tail_end, chunksize, accuracy)
+        merge_accumulators(accumulators, tail)
+
+    return finalize(accumulators)
+
+
+def describe_parallel(path, jobs, chunksize, accuracy):
+    import pandas as pd
+
+    columns = list(pd.read_csv(path, nrows=0).columns)
+    with ProcessPoolExecutor(jobs) as executor:
+        if not chunksize:
+            # Wide inputs: every worker parses and describes its own group of columns
+            groups = [list(group) for group in np.array_split(columns, jobs) if len(group)]
+            features_data = {}
+            for group_data in executor.map(describe_columns, [path] * len(groups), groups):
+                features_data.update(group_data)
+            return features_data
+
+        # Tall inputs: every worker streams its own byte range and returns partial accumulators
+        features = list(pd.read_csv(path, nrows=chunksize).select_dtypes(include="number"))
+        futures = [
+            executor.submit(accumulate_range, path, columns, features, start, end, chunksize, accuracy)
+            for start, end in byte_ranges(path, jobs)
+            if start < end
+        ]
+        accumulators = {}
+        for future in futures:
+            merge_accumulators(accumulators, future.result())
+        return finalize(accumulators)
+
+
+def format_table(features_data):
+    SPACING = 8
+    SPACES = " " * SPACING
+    formatted = SPACES * 2 + SPACES.join(features_data) + "\n"
+    for name in FUNCTIONS:
+        formatted += (
+            "{:<{}}".format(name, SPACING)
+            + "".join(
+                "{:>{}.6f}".format(feature_data[name], SPACING + len(feature))
+                for feature, feature_data in features_data.items()
+            )
+            + "\n"
+        )
+    return formatted
+
+
+def to_frame(features_data):
+    import pandas as pd
+
+    return pd.DataFrame(features_data).loc[list(FUNCTIONS)].rename_axis("Statistic")
+
+
+def format_output(features_data, output_format, by=None):
+    if output_format == "json":
+
+        def plain(data):
+            if isinstance(data, dict):
+                return {str(key): plain(value) for key, value in data.items()}
+            return None if np.isnan(data) else float(data)
+
+        return json.dumps(plain(features_data), indent=4) + "\n"
+    if by is None:
+        return to_frame(features_data).to_csv() if output_format == "csv" else format_table(features_data)
+    if output_format == "csv":
+        import pandas as pd
+
+        frames = {label: to_frame(group_data) for label, group_data in features_data.items()}
+        return pd.concat(frames, names=[by]).to_csv()
+    return "\n".join(f"{by}: {label}\n" + format_table(group_data) for label, group_data in features_data.items())
+
+
 def parse_args():
     parser = ArgumentParser(
         prog="describe",
@@ -66,41 +593,90 @@ def parse_args():
     parser.add_argument(
         "path",
         nargs="?",
-        help="Path of the input csv dataset. Defaults to 'data/dataset_train.csv'.",
+        help="Path of the input csv dataset, or a directory or glob of shards. Defaults to 'data/dataset_train.csv'.",
         default="data/dataset_train.csv",
     )
 
-    return parser.parse_args()
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        help="Stream the dataset in chunks of this many rows instead of loading it whole. Quartiles are then approximated.",
+    )
+
+    parser.add_argument(
+        "--quantile-accuracy",
+        type=float,
+        default=DEFAULT_QUANTILE_ACCURACY,
+        help=f"Relative rank error of the streamed quartiles. Defaults to {DEFAULT_QUANTILE_ACCURACY}.",
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Number of worker processes. Columns are split between workers, or byte ranges of the file with --chunksize. "
+        "Shards are split between workers, as many as CPUs by default.",
+    )
+
+    parser.add_argument(
+        "--by",
+        type=str,
+        help="Describe the dataset separately for each value of this column, e.g. 'Hogwarts House'.",
+    )
+
+    parser.add_argument(
+        "--format",
+        choices=["table", "csv", "json"],
+        default="table",
+        help="Output format of the description. Defaults to 'table'.",
+    )
+
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help=f"Keep the accumulators in a '{CACHE_SUFFIX}' file next to the dataset and only read the rows appended since the last run. Quartiles are then approximated.",
+    )
+
+    args = parser.parse_args()
+    if args.by and (args.chunksize or (args.jobs or 1) > 1 or args.cache):
+        parser.error("--by cannot be combined with --chunksize, --jobs or --cache.")
+    if args.cache and (args.jobs or 1) > 1:
+        parser.error("--cache cannot be combined with --jobs.")
+
+    return args
 
 
 def main():
     args = parse_args()
 
     try:
-        data = pd.read_csv(args.path)
-
-        features = data.select_dtypes(include="number")
-        # del features["Index"]
-        features_data = {}
-        for feature in features:
-            feature_data = {}
-            for name, fun in FUNCTIONS.items():
-                feature_data[name] = fun(data[feature])
-            features_data[feature] = feature_data
-
-        SPACING = 8
-        SPACES = " " * SPACING
-        formatted = SPACES * 2 + SPACES.join(features) + "\n"
-        for name in FUNCTIONS:
-            formatted += (
-                "{:<{}}".format(name, SPACING)
-                + "".join(
-                    "{:>{}.6f}".format(feature_data[name], SPACING + len(feature))
-                    for feature, feature_data in features_data.items()
-                )
-                + "\n"
+        paths = expand_paths(args.path)
+        if len(paths) > 1:
+            if args.cache:
+                print("Error: --cache needs a single file, not a directory or glob of shards.")
+                return
+            jobs = args.jobs or os.cpu_count() or 1
+            if args.by:
+                features_data = describe_groups(read_shard_frames(paths, jobs), args.by)
+            else:
+                features_data = describe_shards(paths, jobs, args.chunksize, args.quantile_accuracy)
+        elif args.by:
+            import pandas as pd
+
+            features_data = describe_groups(pd.read_csv(args.path), args.by)
+        elif args.cache:
+            features_data = describe_incremental(
+                args.path, args.chunksize or DEFAULT_CACHE_CHUNKSIZE, args.quantile_accuracy
             )
-        print(end=formatted)
+        elif args.jobs and args.jobs > 1:
+            features_data = describe_parallel(args.path, args.jobs, args.chunksize, args.quantile_accuracy)
+        elif args.chunksize:
+            features_data = describe_stream(args.path, args.chunksize, args.quantile_accuracy)
+        else:
+            features_data = describe_numeric_columns(args.path)
+
+        print(end=format_output(features_data, args.format, args.by))
+        if (args.chunksize or args.cache) and args.format == "table":
+            print(f"Quartiles are approximate, rank error within ±{args.quantile_accuracy:.2%} of the count.")
 
     except FileNotFoundError:
         print(f"Error: File '{args.path}' not found.")
@@ -1,32 +1,81 @@
-from utils import parse_csv, CSVValidationError, AVAILABLE_COURSES
+from utils import (
+    read_csv_columns,
+    parse_csv,
+    parse_csv_chunks,
+    expand_paths,
+    CSVValidationError,
+    AVAILABLE_COURSES,
+    SOURCE_LEVEL,
+    LEAN_READER_MAX_BYTES,
+)
+from model import is_model_file, load_model, ModelFormatError
 import pickle
 import numpy as np
 import argparse
 import csv
+import os
+import resource
+import sys
+import time
 
 
 DEFAULT_LOCATION_DATASET_TEST = "data/dataset_test.csv"
 DEFAULT_OUTPUT_PREDICTION = "houses.csv"
+# Class order of the models saved before the labels were recorded
+LEGACY_LABELS = ["Gryffindor", "Slytherin", "Hufflepuff", "Ravenclaw"]
 
 
 def sigmoid(z):
     return 1 / (1 + np.exp(-z))
 
 
-def predict(X, weights, biases):
-    logits = np.dot(X, np.array(weights).T) + np.array(biases)
-    probabilities = sigmoid(logits)
+def softmax(z):
+    exp = np.exp(z - np.max(z, axis=1, keepdims=True))
+    return exp / np.sum(exp, axis=1, keepdims=True)
+
+
+# Models saved before the mode was recorded are One-vs-Rest
+SCORING = {"ovr": sigmoid, "multinomial": softmax}
+
+
+def predict_probabilities(X, weights, biases, mode="ovr"):
+    logits = np.dot(X, np.asarray(weights).T) + np.asarray(biases)
+    return SCORING[mode](logits)
+
+
+def predict(X, weights, biases, mode="ovr"):
+    probabilities = predict_probabilities(X, weights, biases, mode)
     predictions = np.argmax(probabilities, axis=1)
 
     return predictions
 
 
+def preprocess(X, preprocessing=None):
+    # Missing scores are replaced by the mean of their course, so they become 0 once standardized
+    if preprocessing is None:
+        # Models saved without their training statistics fall back to the statistics of the input
+        mean, std = np.nanmean(X, axis=0), None
+    else:
+        mean, std = np.asarray(preprocessing["mean"]), np.asarray(preprocessing["std"])
+
+    X = np.where(np.isnan(X), mean, X)
+    if std is None:
+        return (X - np.mean(X, axis=0)) / np.std(X, axis=0)
+    return (X - mean) / std
+
+
 def load_model_from_pickle(model_file):
     with open(model_file, "rb") as f:
         model_data = pickle.load(f)
     return model_data
 
 
+def load_model_file(model_file):
+    if is_model_file(model_file):
+        return load_model(model_file)
+    return load_model_from_pickle(model_file)
+
+
 def parse_args():
     parser = argparse.ArgumentParser(
         prog="logreg_predict",
@@ -37,14 +86,14 @@ def parse_args():
         "--model-file",
         type=str,
         required=True,
-        help="Path to the .pkl file containing the trained model weights and biases.",
+        help="Path to the model file containing the trained weights and biases, either a dslr model file or a legacy .pkl file.",
     )
 
     parser.add_argument(
         "--input-file",
         type=str,
         default=DEFAULT_LOCATION_DATASET_TEST,
-        help=f"Path to the input dataset (CSV format) for making predictions. Defaults to '{DEFAULT_LOCATION_DATASET_TEST}' if not specified.",
+        help=f"Path to the input dataset (CSV format) for making predictions, or a directory or glob of shards whose rows are then tagged with a Source column. Defaults to '{DEFAULT_LOCATION_DATASET_TEST}' if not specified.",
     )
 
     parser.add_argument(
@@ -54,6 +103,58 @@ def parse_args():
         help=f"Path to the output file where predictions will be saved. Defaults to '{DEFAULT_OUTPUT_PREDICTION}' if not specified.",
     )
 
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        help="Read, score and write the input in chunks of this many rows to keep memory bounded.",
+    )
+
+    parser.add_argument(
+        "--probabilities",
+        action="store_true",
+        help="Also write the probability of every house.",
+    )
+
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Keep the model loaded and serve predictions over HTTP instead of reading --input-file. POST JSON or CSV rows to /predict, GET /stats for request counts and latency percentiles. The model is reloaded when its file changes.",
+    )
+
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Address the server listens on. Defaults to '127.0.0.1'.",
+    )
+
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8000,
+        help="Port the server listens on. Defaults to 8000.",
+    )
+
+    parser.add_argument(
+        "--socket",
+        type=str,
+        help="Listen on this unix socket instead of --host and --port.",
+    )
+
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=256,
+        help="Maximum number of rows scored together by the server. Defaults to 256.",
+    )
+
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=5.0,
+        help="Maximum time the server waits for more requests before scoring a batch. Defaults to 5 ms.",
+    )
+
     return parser.parse_args()
 
 
@@ -61,38 +162,71 @@ def main():
     args = parse_args()
 
     try:
-        data = parse_csv(args.input_file, predict=True)
-
-        X = np.array(data[AVAILABLE_COURSES].values)
+        if args.serve:
+            from server import serve
 
-        # Replace NaN values with mean of courses, so after it will be 0 in the normalized vector X with standardization
-        nan_mask = np.isnan(X)
-        mean_values = np.nanmean(X, axis=0)
-        X[nan_mask] = np.take(mean_values, np.where(nan_mask)[1])
+            serve(args.model_file, args.host, args.port, args.socket, args.max_batch_size, args.max_wait_ms)
+            return
 
-        X = (X - np.mean(X, axis=0)) / np.std(X, axis=0)
+        start = time.perf_counter()
 
-        model_data = load_model_from_pickle(args.model_file)
+        model_data = load_model_file(args.model_file)
+        preprocessing = model_data.get("preprocessing")
+        features = preprocessing["features"] if preprocessing else AVAILABLE_COURSES
         weights = model_data["weights"]
         biases = model_data["biases"]
-
-        predictions = predict(X, weights, biases)
-        predicted_houses = [
-            {0: "Gryffindor", 1: "Slytherin", 2: "Hufflepuff", 3: "Ravenclaw"}[pred]
-            for pred in predictions
-        ]
-
+        mode = model_data.get("mode", "ovr")
+        labels = np.asarray(model_data.get("labels", LEGACY_LABELS))
+
+        # A directory or a glob of shards adds a Source column naming the file of every row
+        sharded = len(expand_paths(args.input_file)) > 1
+
+        def split(data):
+            X = np.array(data[features].values, dtype=float)
+            if sharded:
+                return data.index.get_level_values("Index"), data.index.get_level_values(SOURCE_LEVEL), X
+            return data.index, None, X
+
+        if args.chunksize:
+            if preprocessing is None:
+                raise ModelFormatError(
+                    "Chunked prediction needs a model saved with its preprocessing, retrain the model."
+                )
+            chunks = map(split, parse_csv_chunks(args.input_file, args.chunksize, predict=True, columns=features))
+        elif sharded or os.path.getsize(args.input_file) > LEAN_READER_MAX_BYTES:
+            # Only streaming, shards and large files need pandas, a small file is read by the lean csv reader
+            chunks = [split(parse_csv(args.input_file, predict=True, columns=features))]
+        else:
+            index, columns = read_csv_columns(args.input_file, predict=True, columns=features)
+            chunks = [(index, None, np.column_stack([columns[feature] for feature in features]))]
+
+        rows = 0
         with open(args.output_file, mode="w", newline="") as file:
             writer = csv.writer(file)
-            writer.writerow(["Index", "Hogwarts House"])
-            for i, house in enumerate(predicted_houses):
-                writer.writerow([i, house])
-
+            writer.writerow(
+                ["Index", "Hogwarts House"]
+                + (labels.tolist() if args.probabilities else [])
+                + ([SOURCE_LEVEL] if sharded else [])
+            )
+            for index, sources, X in chunks:
+                probabilities = predict_probabilities(preprocess(X, preprocessing), weights, biases, mode)
+                houses = np.take(labels, np.argmax(probabilities, axis=1))
+
+                columns = [index, houses] + (probabilities.T.tolist() if args.probabilities else [])
+                if sharded:
+                    columns.append(sources)
+                writer.writerows(zip(*columns))
+                rows += len(houses)
+
+        elapsed = time.perf_counter() - start
+        # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
         print(f"Predictions saved to {args.output_file}")
+        print(f"Scored {rows} rows in {elapsed:.2f}s ({rows / elapsed:.0f} rows/s), peak RSS {peak:.1f} MiB")
 
-    except FileNotFoundError:
-        print(f"Error: File '{args.path}' not found.")
-    except CSVValidationError as ex:
+    except FileNotFoundError as ex:
+        print(f"Error: File '{ex.filename}' not found.")
+    except (CSVValidationError, ModelFormatError) as ex:
         print(f"{ex.__class__.__name__}: {ex}")
     except Exception as ex:
         print(f"Unexpected error occured : {ex}")
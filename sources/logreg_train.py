@@ -1,15 +1,36 @@
 from utils import parse_csv, CSVValidationError, AVAILABLE_COURSES, DEFAULT_LOCATION_DATASET_TRAIN
+from model import save_model, replacing
+from dataset import class_labels, convert_to_memmap, DEFAULT_BLOCK_ROWS
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from multiprocessing import shared_memory
 import numpy as np
 import pickle
 
 
-NUMBER_OF_HOUSES = 4
-DEFAULT_LOCATION_JSON = "weights.pkl"
+# Class order of the models, the classes are the houses found in the training data
+HOUSES = ["Gryffindor", "Slytherin", "Hufflepuff", "Ravenclaw"]
+DEFAULT_LOCATION_MODEL = "weights.dslr"
 
 
 constant = lambda x: lambda _: x  # noqa: E731
-OPTIMIZERS_BATCH_SIZE = {"minibatch": constant(64), "gd": len, "sgd": constant(1)}
+OPTIMIZERS_BATCH_SIZE = {
+    "minibatch": constant(64),
+    "gd": len,
+    "sgd": constant(1),
+    "newton": len,
+    "lbfgs": len,
+}
+DEFAULT_TOLERANCE = 1e-6
+DEFAULT_SEED = 42
+DEFAULT_DECAY_RATE = 0.5
+DEFAULT_DECAY_STEPS = 100
+DEFAULT_PATIENCE = 5
+DEFAULT_MIN_DELTA = 1e-4
+DEFAULT_EVAL_EVERY = 10
+LBFGS_HISTORY = 10
+NEWTON_DAMPING = 1e-4
 
 
 def parse_args():
@@ -33,110 +54,824 @@ def parse_args():
         "--input-file",
         type=str,
         default=DEFAULT_LOCATION_DATASET_TRAIN,
-        help=f"Path to the input CSV dataset. Defaults to '{DEFAULT_LOCATION_DATASET_TRAIN}' if not specified.",
+        help=f"Path to the input CSV dataset, or a directory or glob of shards. Defaults to '{DEFAULT_LOCATION_DATASET_TRAIN}' if not specified.",
     )
 
     parser.add_argument(
         "--output_file",
         type=str,
-        default=DEFAULT_LOCATION_JSON,
-        help=f"Path to the output JSON file where model weights and biases will be saved. Defaults to '{DEFAULT_LOCATION_JSON}' if not specified.",
+        default=DEFAULT_LOCATION_MODEL,
+        help=f"Path to the output model file where weights, biases and preprocessing will be saved. Files ending in '.pkl' use the legacy pickle format. Defaults to '{DEFAULT_LOCATION_MODEL}' if not specified.",
     )
 
     parser.add_argument(
         "--optimizer",
-        choices=["gd", "minibatch", "sgd"],
+        choices=["gd", "minibatch", "sgd", "newton", "lbfgs"],
         default="gd",
-        help="Choose the optimization method: 'gd' for full batch gradient descent, 'minibatch' for mini-batch gradient descent, or 'sgd' for stochastic gradient descent.",
+        help="Choose the optimization method: 'gd' for full batch gradient descent, 'minibatch' for mini-batch gradient descent, 'sgd' for stochastic gradient descent, 'newton' for Newton's method (IRLS) or 'lbfgs' for L-BFGS. With 'newton' and 'lbfgs', --epochs is the maximum number of iterations.",
     )
 
-    return parser.parse_args()
+    parser.add_argument(
+        "--tol",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help=f"Stop 'newton' and 'lbfgs' once the gradient norm or the loss change falls below this value. Defaults to {DEFAULT_TOLERANCE}.",
+    )
+
+    parser.add_argument(
+        "--update",
+        choices=list(UPDATES),
+        default="plain",
+        help="Choose the update rule of 'gd', 'minibatch' and 'sgd': 'plain' gradient steps, 'momentum', 'nesterov' momentum, 'adam' or 'rmsprop'.",
+    )
+
+    parser.add_argument(
+        "--schedule",
+        choices=list(SCHEDULES),
+        default="constant",
+        help="Choose how the learning rate evolves over the epochs: 'constant', 'step' decay, 'cosine' annealing or 'inverse_time' decay.",
+    )
+
+    parser.add_argument(
+        "--decay-rate",
+        type=float,
+        default=DEFAULT_DECAY_RATE,
+        help=f"Decay rate of the 'step' and 'inverse_time' schedules. Defaults to {DEFAULT_DECAY_RATE}.",
+    )
+
+    parser.add_argument(
+        "--decay-steps",
+        type=int,
+        default=DEFAULT_DECAY_STEPS,
+        help=f"Number of epochs between two decays of the 'step' and 'inverse_time' schedules. Defaults to {DEFAULT_DECAY_STEPS}.",
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=DEFAULT_SEED,
+        help=f"Seed of the generator shuffling the batches of 'minibatch' and 'sgd' every epoch. Defaults to {DEFAULT_SEED}.",
+    )
+
+    parser.add_argument(
+        "--validation-split",
+        type=float,
+        default=0.0,
+        help="Fraction of the dataset, below 1, held out to stop 'gd', 'minibatch' and 'sgd' early once the validation loss stops improving. Disabled by default.",
+    )
+
+    parser.add_argument(
+        "--patience",
+        type=int,
+        default=DEFAULT_PATIENCE,
+        help=f"Number of evaluations without improvement before stopping early. Defaults to {DEFAULT_PATIENCE}.",
+    )
+
+    parser.add_argument(
+        "--min-delta",
+        type=float,
+        default=DEFAULT_MIN_DELTA,
+        help=f"Minimum decrease of the validation loss counted as an improvement. Defaults to {DEFAULT_MIN_DELTA}.",
+    )
+
+    parser.add_argument(
+        "--eval-every",
+        type=int,
+        default=DEFAULT_EVAL_EVERY,
+        help=f"Number of epochs between two evaluations of the validation loss. Defaults to {DEFAULT_EVAL_EVERY}.",
+    )
+
+    parser.add_argument(
+        "--mode",
+        choices=["ovr", "multinomial"],
+        default="ovr",
+        help="Choose the model: 'ovr' for one binary classifier per house (One-vs-Rest), or 'multinomial' for a single softmax classifier trained on all houses at once.",
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes training the One-vs-Rest classifiers in parallel.",
+    )
+
+    parser.add_argument(
+        "--out-of-core",
+        type=str,
+        metavar="DIRECTORY",
+        help="Stream the dataset into memory-mapped matrices in this directory and train from them "
+        "block by block, for datasets larger than memory. Needs 'minibatch' or 'sgd' and --mode ovr.",
+    )
+
+    parser.add_argument(
+        "--storage-dtype",
+        choices=["float64", "float32"],
+        default="float64",
+        help="Type of the memory-mapped features with --out-of-core, float32 halves the disk reads. Defaults to float64.",
+    )
+
+    parser.add_argument(
+        "--block-rows",
+        type=int,
+        default=DEFAULT_BLOCK_ROWS,
+        help=f"Rows read from disk at a time with --out-of-core, the unit of shuffling. Defaults to {DEFAULT_BLOCK_ROWS}.",
+    )
+
+    args = parser.parse_args()
+    if not 0 <= args.validation_split < 1:
+        parser.error("--validation-split must be at least 0 and below 1.")
+    if args.jobs > 1 and args.mode != "ovr":
+        parser.error("--jobs is only available with --mode ovr.")
+    if args.out_of_core and (args.optimizer not in ("minibatch", "sgd") or args.mode != "ovr" or args.jobs > 1):
+        parser.error("--out-of-core needs --optimizer minibatch or sgd, --mode ovr and a single job.")
+
+    return args
 
 
 def sigmoid(z):
     return 1 / (1 + np.exp(-z))
 
 
-def gradient_descent_binary(X, y, weights, bias, learning_rate, epochs, batch):
-    m = X.shape[0]
+def softmax(z):
+    exp = np.exp(z - np.max(z, axis=1, keepdims=True))
+    return exp / np.sum(exp, axis=1, keepdims=True)
 
-    for _ in range(epochs):
-        for j in range(0, m, batch):
-            X_batch = X[j : j + batch]
-            y_batch = y[j : j + batch]
 
+# Update rules: each call creates the state of one parameter and returns the function
+# turning its gradient into the step to subtract, given the current learning rate
+
+
+def plain_update():
+    return lambda gradient, learning_rate: learning_rate * gradient
+
+
+def momentum_update(beta=0.9):
+    velocity = 0
+
+    def step(gradient, learning_rate):
+        nonlocal velocity
+        velocity = beta * velocity + gradient
+        return learning_rate * velocity
+
+    return step
+
+
+def nesterov_update(beta=0.9):
+    velocity = 0
+
+    def step(gradient, learning_rate):
+        nonlocal velocity
+        velocity = beta * velocity + gradient
+        return learning_rate * (gradient + beta * velocity)
+
+    return step
+
+
+def adam_update(beta1=0.9, beta2=0.999, epsilon=1e-8):
+    first, second, t = 0, 0, 0
+
+    def step(gradient, learning_rate):
+        nonlocal first, second, t
+        t += 1
+        first = beta1 * first + (1 - beta1) * gradient
+        second = beta2 * second + (1 - beta2) * gradient**2
+        return learning_rate * (first / (1 - beta1**t)) / (np.sqrt(second / (1 - beta2**t)) + epsilon)
+
+    return step
+
+
+def rmsprop_update(rho=0.9, epsilon=1e-8):
+    second = 0
+
+    def step(gradient, learning_rate):
+        nonlocal second
+        second = rho * second + (1 - rho) * gradient**2
+        return learning_rate * gradient / (np.sqrt(second) + epsilon)
+
+    return step
+
+
+UPDATES = {
+    "plain": plain_update,
+    "momentum": momentum_update,
+    "nesterov": nesterov_update,
+    "adam": adam_update,
+    "rmsprop": rmsprop_update,
+}
+
+
+def constant_schedule(learning_rate, epoch, epochs, **_):
+    return learning_rate
+
+
+def step_schedule(learning_rate, epoch, epochs, decay_rate=DEFAULT_DECAY_RATE, decay_steps=DEFAULT_DECAY_STEPS):
+    return learning_rate * decay_rate ** (epoch // decay_steps)
+
+
+def cosine_schedule(learning_rate, epoch, epochs, **_):
+    return learning_rate * (1 + np.cos(np.pi * epoch / epochs)) / 2
+
+
+def inverse_time_schedule(learning_rate, epoch, epochs, decay_rate=DEFAULT_DECAY_RATE, decay_steps=DEFAULT_DECAY_STEPS):
+    return learning_rate / (1 + decay_rate * epoch / decay_steps)
+
+
+SCHEDULES = {
+    "constant": constant_schedule,
+    "step": step_schedule,
+    "cosine": cosine_schedule,
+    "inverse_time": inverse_time_schedule,
+}
+
+
+def shuffled(rng, batch, *arrays):
+    # Full batches are left in file order, smaller ones are reshuffled at every epoch
+    if batch >= len(arrays[0]):
+        return arrays
+    order = rng.permutation(len(arrays[0]))
+    return tuple(array[order] for array in arrays)
+
+
+def block_batches(rng, batch, X, y, block_rows):
+    # Memory-mapped data: blocks are visited in shuffled order and shuffled once in memory,
+    # a reader thread copies the next block from disk while the current one is trained on
+    starts = rng.permutation(np.arange(0, len(X), block_rows))
+
+    def read(start):
+        return np.array(X[start : start + block_rows]), np.array(y[start : start + block_rows])
+
+    with ThreadPoolExecutor(1) as reader:
+        pending = reader.submit(read, starts[0])
+        for k in range(len(starts)):
+            X_block, y_block = pending.result()
+            if k + 1 < len(starts):
+                pending = reader.submit(read, starts[k + 1])
+
+            X_block, y_block = shuffled(rng, batch, X_block, y_block)
+            for j in range(0, len(X_block), batch):
+                yield X_block[j : j + batch], y_block[j : j + batch]
+
+
+class EarlyStopping:
+    """Evaluate the validation loss and accuracy every few epochs and remember the best parameters seen.
+
+    Stopping is decided on the loss, every evaluation is kept in history as (epoch, loss, accuracy).
+    """
+
+    def __init__(self, evaluate, patience=DEFAULT_PATIENCE, min_delta=DEFAULT_MIN_DELTA, every=DEFAULT_EVAL_EVERY):
+        self.evaluate = evaluate
+        self.patience = patience
+        self.min_delta = min_delta
+        self.every = every
+        self.best_loss = np.inf
+        self.best = None
+        self.best_scores = None
+        self.history = []
+        self.waited = 0
+        self.epochs = 0
+
+    def check(self, epoch, last, *parameters):
+        self.epochs = epoch
+        if epoch % self.every and not last:
+            return False
+
+        loss, accuracy = self.evaluate(*parameters)
+        self.history.append((epoch, loss, accuracy))
+        if loss < self.best_loss - self.min_delta:
+            self.best_loss, self.best, self.waited = loss, [np.copy(parameter) for parameter in parameters], 0
+            self.best_scores = self.history[-1]
+            return False
+
+        self.waited += 1
+        return self.waited >= self.patience
+
+    def restore(self, *parameters):
+        return self.best if self.best is not None else parameters
+
+
+def binary_validation_scores(X, y):
+    # Loss and accuracy from the same logits, the accuracy costs one comparison more
+    def evaluate(weights, bias):
+        z = np.dot(X, weights) + bias
+        return np.mean(np.logaddexp(0, z) - y * z), np.mean((z > 0) == y)
+
+    return evaluate
+
+
+def multinomial_validation_scores(X, y):
+    def evaluate(weights, biases):
+        z = np.dot(X, weights) + biases
+        return np.mean(logsumexp(z) - z[np.arange(len(y)), y]), np.mean(np.argmax(z, axis=1) == y)
+
+    return evaluate
+
+
+def gradient_descent_binary(
+    X,
+    y,
+    weights,
+    bias,
+    learning_rate,
+    epochs,
+    batch,
+    update="plain",
+    schedule=constant_schedule,
+    seed=None,
+    early_stopping=None,
+    block_rows=DEFAULT_BLOCK_ROWS,
+):
+    m = X.shape[0]
+    rng = np.random.default_rng(seed)
+    weights_step, bias_step = UPDATES[update](), UPDATES[update]()
+
+    for epoch in range(epochs):
+        rate = schedule(learning_rate, epoch, epochs)
+        if isinstance(X, np.memmap):
+            batches = block_batches(rng, batch, X, y, block_rows)
+        else:
+            X_epoch, y_epoch = shuffled(rng, batch, X, y)
+            batches = ((X_epoch[j : j + batch], y_epoch[j : j + batch]) for j in range(0, m, batch))
+
+        for X_batch, y_batch in batches:
             z = np.dot(X_batch, weights) + bias
             y_pred = sigmoid(z)
 
             dw = np.dot(X_batch.T, (y_pred - y_batch)) / batch
             db = np.sum(y_pred - y_batch) / batch
 
-            weights -= learning_rate * dw
-            bias -= learning_rate * db
+            weights -= weights_step(dw, rate)
+            bias -= bias_step(db, rate)
+
+        if early_stopping and early_stopping.check(epoch + 1, epoch + 1 == epochs, weights, bias):
+            break
+
+    if early_stopping:
+        weights, bias = early_stopping.restore(weights, bias)
 
     return weights, bias
 
 
-def train_logistic_regression_ovr(X, y, num_classes, learning_rate, epochs, batch):
-    n_features = X.shape[1]
+def with_bias(X):
+    return np.hstack((X, np.ones((X.shape[0], 1))))
+
+
+def logsumexp(z):
+    top = np.max(z, axis=1)
+    return top + np.log(np.sum(np.exp(z - top[:, None]), axis=1))
+
+
+def binary_objective(X, y):
+    # Mean log-loss of the parameters [weights..., bias], with its gradient and hessian
+    Xb = with_bias(X)
+    m = Xb.shape[0]
+
+    def loss_gradient(theta):
+        z = np.dot(Xb, theta)
+        loss = np.mean(np.logaddexp(0, z) - y * z)
+        return loss, np.dot(Xb.T, sigmoid(z) - y) / m
+
+    def hessian(theta):
+        p = sigmoid(np.dot(Xb, theta))
+        return np.dot(Xb.T * (p * (1 - p)), Xb) / m
+
+    return loss_gradient, hessian
+
+
+def multinomial_objective(X, Y):
+    # Mean cross-entropy of the flattened (n_features + 1, num_classes) parameters, bias last
+    Xb = with_bias(X)
+    m = Xb.shape[0]
+    shape = (Xb.shape[1], Y.shape[1])
+
+    def loss_gradient(theta):
+        z = np.dot(Xb, theta.reshape(shape))
+        loss = np.mean(logsumexp(z) - np.sum(Y * z, axis=1))
+        return loss, (np.dot(Xb.T, softmax(z) - Y) / m).ravel()
+
+    def hessian(theta):
+        p = softmax(np.dot(Xb, theta.reshape(shape)))
+        curvature = np.einsum("ik,kl->ikl", p, np.eye(shape[1])) - np.einsum("ik,il->ikl", p, p)
+        H = np.einsum("ia,ikl,ib->akbl", Xb, curvature, Xb, optimize=True) / m
+        return H.reshape(theta.size, theta.size)
+
+    return loss_gradient, hessian
+
+
+def line_search(loss_gradient, theta, direction, loss, gradient):
+    # Backtracking until the Armijo sufficient decrease condition holds
+    slope = np.dot(gradient, direction)
+    step = 1.0
+    while True:
+        candidate = theta + step * direction
+        candidate_loss, candidate_gradient = loss_gradient(candidate)
+        if candidate_loss <= loss + 1e-4 * step * slope or step < 1e-10:
+            return candidate, candidate_loss, candidate_gradient
+        step /= 2
+
+
+def converged(previous_loss, loss, gradient, tol):
+    return np.linalg.norm(gradient) < tol or abs(previous_loss - loss) < tol
+
+
+def newton(loss_gradient, hessian, theta, max_iterations, tol):
+    loss, gradient = loss_gradient(theta)
+    iteration = 0
+
+    while iteration < max_iterations and np.linalg.norm(gradient) >= tol:
+        iteration += 1
+        # Damped step, the hessian is (nearly) singular along collinear courses
+        # (e.g. Astronomy and Defense Against the Dark Arts) and for the softmax parameters
+        step = np.linalg.solve(hessian(theta) + NEWTON_DAMPING * np.eye(theta.size), gradient)
+        previous_loss = loss
+        theta, loss, gradient = line_search(loss_gradient, theta, -step, loss, gradient)
+        if converged(previous_loss, loss, gradient, tol):
+            break
+
+    return theta, iteration, loss
+
+
+def lbfgs(loss_gradient, hessian, theta, max_iterations, tol):
+    loss, gradient = loss_gradient(theta)
+    history = []
+    iteration = 0
+
+    while iteration < max_iterations and np.linalg.norm(gradient) >= tol:
+        iteration += 1
+
+        # Two-loop recursion, approximates the inverse hessian times the gradient
+        direction = gradient.copy()
+        alphas = []
+        for s, y, rho in reversed(history):
+            alpha = rho * np.dot(s, direction)
+            direction -= alpha * y
+            alphas.append(alpha)
+        if history:
+            s, y, _ = history[-1]
+            direction *= np.dot(s, y) / np.dot(y, y)
+        for (s, y, rho), alpha in zip(history, reversed(alphas)):
+            direction += s * (alpha - rho * np.dot(y, direction))
+        direction = -direction
+
+        if np.dot(gradient, direction) >= 0:
+            history.clear()
+            direction = -gradient
+
+        previous_theta, previous_loss, previous_gradient = theta, loss, gradient
+        theta, loss, gradient = line_search(loss_gradient, theta, direction, loss, gradient)
+
+        s, y = theta - previous_theta, gradient - previous_gradient
+        if np.dot(s, y) > 1e-12:
+            history = history[-(LBFGS_HISTORY - 1) :] + [(s, y, 1 / np.dot(s, y))]
+
+        if converged(previous_loss, loss, gradient, tol):
+            break
+
+    return theta, iteration, loss
+
+
+SOLVERS = {"newton": newton, "lbfgs": lbfgs}
+
+
+def train_binary_class(
+    X,
+    y,
+    i,
+    learning_rate,
+    epochs,
+    batch,
+    optimizer="gd",
+    tol=DEFAULT_TOLERANCE,
+    validation=None,
+    stopping=None,
+    **descent_options,
+):
+    # int8 keeps the labels of a memory-mapped dataset small, the arithmetic is unchanged
+    binary_y = (y == i).astype(np.int8)
+
+    if optimizer in SOLVERS:
+        loss_gradient, hessian = binary_objective(X, binary_y)
+        theta, iterations, loss = SOLVERS[optimizer](
+            loss_gradient, hessian, np.zeros(X.shape[1] + 1), epochs, tol
+        )
+        return theta[:-1], theta[-1], iterations, loss, None
+
+    weights = np.zeros(X.shape[1])
+    bias = 0
+
+    early_stopping = None
+    if validation is not None:
+        X_val, y_val = validation
+        early_stopping = EarlyStopping(binary_validation_scores(X_val, np.where(y_val == i, 1, 0)), **(stopping or {}))
+
+    weights, bias = gradient_descent_binary(
+        X, binary_y, weights, bias, learning_rate, epochs, batch, early_stopping=early_stopping, **descent_options
+    )
+    iterations = early_stopping.epochs if early_stopping else epochs
+    validated = early_stopping.best_scores if early_stopping else None
+    # Without binary_objective, which copies X to append the bias column
+    return weights, bias, iterations, binary_validation_scores(X, binary_y)(weights, bias)[0], validated
+
+
+def report(name, iterations, loss, validated=None):
+    line = f"{name}: {iterations} iterations, final loss {loss:.6f}"
+    if validated is not None:
+        epoch, validation_loss, accuracy = validated
+        line += f", best validation loss {validation_loss:.6f} and accuracy {accuracy:.4f} at epoch {epoch}"
+    print(line)
+
+
+def train_logistic_regression_ovr(
+    X, y, labels, learning_rate, epochs, batch, optimizer="gd", tol=DEFAULT_TOLERANCE, **descent_options
+):
+    n_features, num_classes = X.shape[1], len(labels)
 
     all_weights = np.zeros((num_classes, n_features))
     all_biases = np.zeros(num_classes)
+    all_iterations = []
 
     for i in range(num_classes):
-        binary_y = np.where(y == i, 1, 0)
+        all_weights[i], all_biases[i], iterations, loss, validated = train_binary_class(
+            X, y, i, learning_rate, epochs, batch, optimizer, tol, **descent_options
+        )
+        report(labels[i], iterations, loss, validated)
+        all_iterations.append(iterations)
+
+    return all_weights, all_biases, all_iterations
+
+
+# Arrays shared with the worker processes, attached once per worker
+SHARED_ARRAYS = {}
+
+
+def share_array(array):
+    # The memory layout is kept too, BLAS may round differently on C and Fortran ordered inputs
+    order = "F" if array.flags.f_contiguous and not array.flags.c_contiguous else "C"
+    memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, array.dtype, buffer=memory.buf, order=order)[...] = array
+    return memory, (memory.name, array.shape, array.dtype.str, order)
+
+
+def attach_shared_arrays(specs):
+    for key, (name, shape, dtype, order) in specs.items():
+        memory = shared_memory.SharedMemory(name=name)
+        SHARED_ARRAYS[key] = (memory, np.ndarray(shape, dtype, buffer=memory.buf, order=order))
+
+
+def train_shared_binary_class(i, **options):
+    if "X_val" in SHARED_ARRAYS:
+        options["validation"] = (SHARED_ARRAYS["X_val"][1], SHARED_ARRAYS["y_val"][1])
+    return train_binary_class(SHARED_ARRAYS["X"][1], SHARED_ARRAYS["y"][1], i, **options)
+
+
+def train_logistic_regression_ovr_parallel(
+    X, y, labels, learning_rate, epochs, batch, optimizer="gd", tol=DEFAULT_TOLERANCE, jobs=1, **descent_options
+):
+    num_classes = len(labels)
+    # Every class is trained by its own task on the very same data as the serial path,
+    # X and y are placed in shared memory instead of being pickled to every worker
+    arrays = {"X": X, "y": y}
+    validation = descent_options.pop("validation", None)
+    if validation is not None:
+        arrays["X_val"], arrays["y_val"] = validation
+
+    memories, specs = {}, {}
+    for key, array in arrays.items():
+        memories[key], specs[key] = share_array(array)
+
+    try:
+        with ProcessPoolExecutor(
+            min(jobs, num_classes), initializer=attach_shared_arrays, initargs=(specs,)
+        ) as executor:
+            task = partial(
+                train_shared_binary_class,
+                learning_rate=learning_rate,
+                epochs=epochs,
+                batch=batch,
+                optimizer=optimizer,
+                tol=tol,
+                **descent_options,
+            )
+            results = list(executor.map(task, range(num_classes)))
+    finally:
+        for memory in memories.values():
+            memory.close()
+            memory.unlink()
+
+    all_weights = np.array([weights for weights, *_ in results]).reshape(num_classes, X.shape[1])
+    all_biases = np.array([bias for _, bias, *_ in results], dtype=float)
+    for i, (*_, iterations, loss, validated) in enumerate(results):
+        report(labels[i], iterations, loss, validated)
+
+    return all_weights, all_biases, [iterations for *_, iterations, _, _ in results]
+
+
+def gradient_descent_multinomial(
+    X,
+    Y,
+    weights,
+    biases,
+    learning_rate,
+    epochs,
+    batch,
+    update="plain",
+    schedule=constant_schedule,
+    seed=None,
+    early_stopping=None,
+):
+    m = X.shape[0]
+    rng = np.random.default_rng(seed)
+    weights_step, biases_step = UPDATES[update](), UPDATES[update]()
+
+    for epoch in range(epochs):
+        rate = schedule(learning_rate, epoch, epochs)
+        X_epoch, Y_epoch = shuffled(rng, batch, X, Y)
+
+        for j in range(0, m, batch):
+            X_batch = X_epoch[j : j + batch]
+            Y_batch = Y_epoch[j : j + batch]
+
+            error = softmax(np.dot(X_batch, weights) + biases) - Y_batch
 
-        weights = np.zeros(n_features)
-        bias = 0
+            dw = np.dot(X_batch.T, error) / batch
+            db = np.sum(error, axis=0) / batch
 
-        weights, bias = gradient_descent_binary(
-            X, binary_y, weights, bias, learning_rate, epochs, batch
+            weights -= weights_step(dw, rate)
+            biases -= biases_step(db, rate)
+
+        if early_stopping and early_stopping.check(epoch + 1, epoch + 1 == epochs, weights, biases):
+            break
+
+    if early_stopping:
+        weights, biases = early_stopping.restore(weights, biases)
+
+    return weights, biases
+
+
+def train_logistic_regression_multinomial(
+    X,
+    y,
+    labels,
+    learning_rate,
+    epochs,
+    batch,
+    optimizer="gd",
+    tol=DEFAULT_TOLERANCE,
+    validation=None,
+    stopping=None,
+    **descent_options,
+):
+    n_features, num_classes = X.shape[1], len(labels)
+
+    # One-hot targets, the weights of every class are updated by the same matrix product
+    Y = np.eye(num_classes)[y]
+    loss_gradient, hessian = multinomial_objective(X, Y)
+
+    validated = None
+    if optimizer in SOLVERS:
+        theta, iterations, loss = SOLVERS[optimizer](
+            loss_gradient, hessian, np.zeros((n_features + 1) * num_classes), epochs, tol
+        )
+        theta = theta.reshape(n_features + 1, num_classes)
+        weights, biases = theta[:-1], theta[-1]
+    else:
+        weights = np.zeros((n_features, num_classes))
+        biases = np.zeros(num_classes)
+
+        early_stopping = None
+        if validation is not None:
+            early_stopping = EarlyStopping(multinomial_validation_scores(*validation), **(stopping or {}))
+
+        weights, biases = gradient_descent_multinomial(
+            X, Y, weights, biases, learning_rate, epochs, batch, early_stopping=early_stopping, **descent_options
         )
+        iterations = early_stopping.epochs if early_stopping else epochs
+        validated = early_stopping.best_scores if early_stopping else None
+        loss = loss_gradient(np.vstack((weights, biases)).ravel())[0]
+
+    report("Multinomial", iterations, loss, validated)
 
-        all_weights[i] = weights
-        all_biases[i] = bias
+    # Stored as (num_classes, n_features) like the One-vs-Rest weights
+    return weights.T, biases, [iterations]
 
-    return all_weights, all_biases
 
+TRAINERS = {
+    "ovr": train_logistic_regression_ovr,
+    "multinomial": train_logistic_regression_multinomial,
+}
 
-def save_model_to_pickle(weights, biases, output_file):
-    model_data = {
+
+def build_model_data(weights, biases, labels, mode="ovr", epochs=None, preprocessing=None, training=None):
+    return {
         "weights": weights,
         "biases": biases,
+        "mode": mode,
+        "labels": list(labels),
+        "epochs": epochs,
+        "preprocessing": preprocessing,
+        "training": training,
     }
 
-    with open(output_file, "wb") as f:
+
+def save_model_to_pickle(model_data, output_file):
+    with replacing(output_file) as f:
         pickle.dump(model_data, f)
 
 
+def write_model(model_data, output_file):
+    if output_file.endswith(".pkl"):
+        save_model_to_pickle(model_data, output_file)
+    else:
+        save_model(model_data, output_file)
+    print(f"Weights/biases saved to {output_file}")
+
+
+def load_training_data(input_file):
+    """Standardized scores, class numbers, class labels and the preprocessing of a training dataset."""
+    data = parse_csv(input_file, columns=["Hogwarts House"] + AVAILABLE_COURSES)
+
+    X = np.array(data[AVAILABLE_COURSES].values)
+    labels = class_labels(data["Hogwarts House"].unique(), HOUSES)
+    y = data["Hogwarts House"].map({house: i for i, house in enumerate(labels)}).to_numpy(dtype=int)
+    # Kept in the model so predictions standardize (and impute missing scores) the same way
+    preprocessing = {"features": AVAILABLE_COURSES, "mean": np.mean(X, axis=0), "std": np.std(X, axis=0)}
+    return (X - preprocessing["mean"]) / preprocessing["std"], y, labels, preprocessing
+
+
+def split_validation(X, y, validation_split, seed):
+    """Hold out a validation_split fraction of the rows, drawn by the seeded generator."""
+    held_out = int(round(len(X) * validation_split))
+    if not held_out:
+        raise ValueError(f"--validation-split {validation_split} holds out none of the {len(X)} rows.")
+    if held_out == len(X):
+        raise ValueError(f"--validation-split {validation_split} leaves none of the {len(X)} rows to train on.")
+
+    order = np.random.default_rng(seed).permutation(len(X))
+    validation_index, train_index = np.sort(order[:held_out]), np.sort(order[held_out:])
+    return X[train_index], y[train_index], (X[validation_index], y[validation_index])
+
+
 def main():
     args = parse_args()
 
     try:
-        data = parse_csv(args.input_file)
-
-        X = np.array(data[AVAILABLE_COURSES].values)
-        y = (
-            data["Hogwarts House"]
-            .map({"Gryffindor": 0, "Slytherin": 1, "Hufflepuff": 2, "Ravenclaw": 3})
-            .values
-        )
-        X = (X - np.mean(X, axis=0)) / np.std(X, axis=0)
-
-        weights, biases = train_logistic_regression_ovr(
+        descent_options = {}
+        if args.out_of_core:
+            X, y, labels, validation, preprocessing = convert_to_memmap(
+                args.input_file,
+                args.out_of_core,
+                AVAILABLE_COURSES,
+                HOUSES,
+                dtype=args.storage_dtype,
+                validation_split=args.validation_split,
+                seed=args.seed,
+                block_rows=args.block_rows,
+            )
+            descent_options["block_rows"] = args.block_rows
+        else:
+            X, y, labels, preprocessing = load_training_data(args.input_file)
+
+            validation = None
+            if args.validation_split > 0:
+                X, y, validation = split_validation(X, y, args.validation_split, args.seed)
+
+        trainer = TRAINERS[args.mode]
+        if args.jobs > 1:
+            trainer = partial(train_logistic_regression_ovr_parallel, jobs=args.jobs)
+
+        weights, biases, epochs = trainer(
             X,
             y,
-            NUMBER_OF_HOUSES,
+            labels,
             args.learning_rate,
             args.epochs,
             OPTIMIZERS_BATCH_SIZE[args.optimizer](X),
+            optimizer=args.optimizer,
+            tol=args.tol,
+            update=args.update,
+            schedule=partial(
+                SCHEDULES[args.schedule], decay_rate=args.decay_rate, decay_steps=args.decay_steps
+            ),
+            seed=args.seed,
+            validation=validation,
+            stopping={"patience": args.patience, "min_delta": args.min_delta, "every": args.eval_every},
+            **descent_options,
         )
 
-        save_model_to_pickle(weights, biases, args.output_file)
-        print(f"Weights/biases saved to {args.output_file}")
+        if validation is not None:
+            X_val, y_val = validation
+            accuracy = np.mean(np.argmax(np.dot(X_val, weights.T) + biases, axis=1) == y_val)
+            print(f"Validation accuracy: {accuracy:.4f} on {len(y_val)} held out rows")
+
+        training = {
+            key: getattr(args, key)
+            for key in ("optimizer", "learning_rate", "update", "schedule", "seed", "validation_split", "tol")
+        }
+        write_model(
+            build_model_data(weights, biases, labels, args.mode, epochs, preprocessing, training), args.output_file
+        )
 
-    except FileNotFoundError:
-        print(f"Error: File '{args.path}' not found.")
+    except FileNotFoundError as ex:
+        print(f"Error: File '{ex.filename}' not found.")
     except CSVValidationError as ex:
         print(f"{ex.__class__.__name__}: {ex}")
     except Exception as ex:
@@ -0,0 +1,112 @@
+from contextlib import contextmanager
+import json
+import numpy as np
+import os
+import tempfile
+
+
+# File layout: MAGIC, header length (8 bytes little endian), JSON header, then the raw arrays.
+# Every array starts on an ALIGNMENT boundary, the header gives its dtype, shape and offset
+# from the start of the data section, so it can be memory-mapped without any copy.
+MAGIC = b"DSLRMODL"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+ARRAYS = ("weights", "biases")
+PREPROCESSING_ARRAYS = ("mean", "std")
+
+
+class ModelFormatError(Exception):
+    pass
+
+
+def aligned(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def is_model_file(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+@contextmanager
+def replacing(output_file):
+    """Binary file to write in place of output_file, swapped in only once complete.
+
+    Readers memory-map the model, rewriting it in place would tear or truncate the arrays
+    under them. os.replace is atomic, they keep the old file until they reopen the path.
+    """
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output_file)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp files are private, give the model the mode open() would have
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temporary, 0o666 & ~umask)
+        os.replace(temporary, output_file)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def save_model(model_data, output_file):
+    arrays = {name: np.ascontiguousarray(model_data[name], dtype=float) for name in ARRAYS}
+    metadata = {key: value for key, value in model_data.items() if key not in ARRAYS}
+
+    preprocessing = model_data.get("preprocessing")
+    if preprocessing is not None:
+        for name in PREPROCESSING_ARRAYS:
+            arrays[name] = np.ascontiguousarray(preprocessing[name], dtype=float)
+        metadata["preprocessing"] = {
+            key: value for key, value in preprocessing.items() if key not in PREPROCESSING_ARRAYS
+        }
+
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += aligned(array.nbytes)
+
+    header = json.dumps({"version": FORMAT_VERSION, "arrays": layout, "metadata": metadata}).encode()
+    start = aligned(len(MAGIC) + 8 + len(header))
+
+    with replacing(output_file) as f:
+        f.write(MAGIC + len(header).to_bytes(8, "little") + header)
+        f.write(bytes(start - f.tell()))
+        for array in arrays.values():
+            f.write(array.tobytes())
+            f.write(bytes(aligned(array.nbytes) - array.nbytes))
+
+
+def load_model(model_file):
+    with open(model_file, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ModelFormatError(f"'{model_file}' is not a dslr model file.")
+        size = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(size))
+
+    if header["version"] > FORMAT_VERSION:
+        raise ModelFormatError(
+            f"Model format version {header['version']} is newer than the supported version {FORMAT_VERSION}."
+        )
+
+    start = aligned(len(MAGIC) + 8 + size)
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        shape = tuple(spec["shape"])
+        if np.prod(shape, dtype=int) == 0:
+            arrays[name] = np.empty(shape, dtype=spec["dtype"])
+        else:
+            arrays[name] = np.memmap(
+                model_file, dtype=spec["dtype"], mode="r", offset=start + spec["offset"], shape=shape
+            )
+
+    model_data = dict(header["metadata"])
+    for name in ARRAYS:
+        model_data[name] = arrays[name]
+    if model_data.get("preprocessing") is not None:
+        for name in PREPROCESSING_ARRAYS:
+            model_data["preprocessing"][name] = arrays[name]
+
+    return model_data
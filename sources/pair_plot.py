@@ -6,6 +6,15 @@ from utils import (
     HOUSE_COLORS,
     DEFAULT_LOCATION_DATASET_TRAIN,
 )
+from rendering import (
+    stratified_sample,
+    bin_courses,
+    density_1d,
+    density_2d,
+    draw_density,
+    draw_stacked_histogram,
+    DEFAULT_DENSITY_BINS,
+)
 from matplotlib import pyplot as plt
 import matplotlib.lines as mlines
 import seaborn as sns
@@ -14,6 +23,8 @@ import os
 
 
 DEFAULT_LOCATION_IMAGES = "pair_plot"
+# Side of every panel in inches, sns.pairplot's default
+PANEL_SIZE = 2.5
 
 
 def parse_args():
@@ -26,7 +37,7 @@ def parse_args():
         "--path",
         type=str,
         default=DEFAULT_LOCATION_DATASET_TRAIN,
-        help=f"Path to the input CSV dataset. Defaults to '{DEFAULT_LOCATION_DATASET_TRAIN}' if not specified.",
+        help=f"Path to the input CSV dataset, or a directory or glob of shards. Defaults to '{DEFAULT_LOCATION_DATASET_TRAIN}' if not specified.",
     )
 
     parser.add_argument(
@@ -42,9 +53,54 @@ def parse_args():
         help=f"Folder location of pair plots png files. Defaults to '{DEFAULT_LOCATION_IMAGES}' if not specified.",
     )
 
+    parser.add_argument(
+        "--density",
+        action="store_true",
+        help="Draw every panel as per-house 2D histograms instead of one point per student, for large datasets.",
+    )
+
+    parser.add_argument(
+        "--bins",
+        type=int,
+        default=DEFAULT_DENSITY_BINS,
+        help=f"Bins per axis with --density. Defaults to {DEFAULT_DENSITY_BINS}.",
+    )
+
+    parser.add_argument(
+        "--sample",
+        type=int,
+        help="Plot about this many students, sampled from every house in proportion to its size.",
+    )
+
     return parser.parse_args()
 
 
+def pair_plot_density(df, courses, labels, bins):
+    # Every course is binned once, each panel is then a bincount of bin indices and the
+    # diagonal histograms come from the same indices
+    grids = bin_courses(df, courses, bins)
+    size = PANEL_SIZE * len(courses)
+    figure, axes = plt.subplots(
+        len(courses), len(courses), figsize=(size, size), squeeze=False, gridspec_kw={"wspace": 0.1, "hspace": 0.1}
+    )
+
+    for row, y_course in enumerate(courses):
+        for column, x_course in enumerate(courses):
+            ax = axes[row, column]
+            if row == column:
+                draw_stacked_histogram(ax, grids, density_1d(grids, x_course), x_course)
+                ax.set_xlim(grids["courses"][x_course][0][[0, -1]])
+            else:
+                draw_density(ax, grids, density_2d(grids, x_course, y_course), x_course, y_course)
+            if row == len(courses) - 1:
+                ax.set_xlabel(labels[x_course])
+            if column == 0:
+                ax.set_ylabel(labels[y_course])
+
+    plt.sca(axes[-1, -1])
+    return figure, axes
+
+
 def main():
     args = parse_args()
 
@@ -57,7 +113,7 @@ def main():
             lambda *_: (print("\033[2Ddslr: CTRL+C sent by user."), exit(1)),
         )
 
-        df = parse_csv(args.path)
+        df = parse_csv(args.path, columns=["Hogwarts House"] + AVAILABLE_COURSES)
         course_mapping = {
             "Arithmancy": "Arith",
             "Astronomy": "Astro",
@@ -74,17 +130,24 @@ def main():
             "Flying": "Flying",
         }
 
-        df = df.rename(columns=course_mapping)
+        if args.sample:
+            df = stratified_sample(df, args.sample)
 
-        pair_plot = sns.pairplot(
-            df,
-            vars=[course_mapping[course] for course in sorted(AVAILABLE_COURSES)],
-            hue="Hogwarts House",
-            palette=HOUSE_COLORS,
-            plot_kws={"alpha": 0.7, "s": 10},
-        )
+        if args.density:
+            figure, axes = pair_plot_density(df, sorted(AVAILABLE_COURSES), course_mapping, args.bins)
+        else:
+            df = df.rename(columns=course_mapping)
+
+            pair_plot = sns.pairplot(
+                df,
+                vars=[course_mapping[course] for course in sorted(AVAILABLE_COURSES)],
+                hue="Hogwarts House",
+                palette=HOUSE_COLORS,
+                plot_kws={"alpha": 0.7, "s": 10},
+            )
+            pair_plot._legend.remove()
+            figure, axes = pair_plot.figure, pair_plot.axes
 
-        pair_plot._legend.remove()
         plt.legend(
             handles=[
                 mlines.Line2D(
@@ -103,18 +166,18 @@ def main():
             loc="upper left",
             borderaxespad=0.0,
         )
-        pair_plot.figure.suptitle("Pair Plot of Hogwarts Courses by House")
+        figure.suptitle("Pair Plot of Hogwarts Courses by House")
         plt.gcf().canvas.manager.set_window_title("Hogwarts Courses Pair Plot")
         plt.subplots_adjust(top=0.95, right=0.9)
 
-        for ax in pair_plot.axes.flatten():
+        for ax in axes.flatten():
             ax.set_xticks([])
             ax.set_yticks([])
 
         if args.save:
             if not os.path.exists(args.save_folder):
                 os.makedirs(args.save_folder)
-            pair_plot.savefig(f"{args.save_folder}/pairplot.png", bbox_inches="tight")
+            figure.savefig(f"{args.save_folder}/pairplot.png", bbox_inches="tight")
 
         plt.show()
 
@@ -0,0 +1,156 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from matplotlib.colors import to_rgb
+from utils import HOUSE_COLORS
+from matplotlib import pyplot as plt
+import matplotlib
+import numpy as np
+import time
+
+
+DEFAULT_DENSITY_BINS = 100
+SAMPLE_SEED = 42
+
+
+# Dataset of a worker process, received once when the worker starts rather than with every task
+WORKER_DATA = {}
+
+
+# Canvases of this process by the class building them, their figure is redrawn for every plot
+CANVASES = {}
+
+
+def init_worker(data):
+    # Workers only save figures, the non-interactive backend needs no display
+    matplotlib.use("Agg")
+    WORKER_DATA["data"] = data
+
+
+def render_task(render, name, *task):
+    start = time.perf_counter()
+    render(WORKER_DATA["data"], *task)
+    return name, time.perf_counter() - start
+
+
+def render_parallel(render, tasks, data, jobs):
+    """Run render(data, *task) for every (name, *task) of tasks over jobs worker processes.
+
+    Prints the progress as figures complete, returns the rendering time of every figure.
+    """
+    times = []
+    with ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(data,)) as executor:
+        futures = [executor.submit(render_task, render, *task) for task in tasks]
+        for done, future in enumerate(as_completed(futures), start=1):
+            name, elapsed = future.result()
+            times.append(elapsed)
+            print(f"[{done}/{len(tasks)}] {name} ({elapsed:.2f}s)")
+    return times
+
+
+def report_timing(times, wall, jobs):
+    if times:
+        print(
+            f"Rendered {len(times)} figures in {wall:.2f}s with {jobs} job(s), "
+            f"{sum(times) / len(times):.2f}s per figure"
+        )
+
+
+def interactive():
+    return matplotlib.get_backend().lower() != "agg"
+
+
+def reuse_canvas(build, data):
+    """Return the canvas build(data) of this process, building it on first use.
+
+    A canvas is built again for other data, or once its figure was closed, as closing a shown window does.
+    """
+    canvas = CANVASES.get(build)
+    if canvas is None or canvas.data is not data or not plt.fignum_exists(canvas.figure.number):
+        canvas = CANVASES[build] = build(data)
+    return canvas
+
+
+def stratified_sample(df, size, seed=SAMPLE_SEED):
+    """Keep about size rows, drawing from every house in proportion to its share of the rows."""
+    if size >= len(df):
+        return df
+    houses = df.groupby("Hogwarts House", observed=True, group_keys=False)
+    return houses.sample(frac=size / len(df), random_state=seed).sort_index()
+
+
+def bin_courses(df, courses, bins=DEFAULT_DENSITY_BINS):
+    """Bin every course once, panels then only count precomputed bin indices.
+
+    Returns a dict with the house code of every row, the house names, and for every
+    course its bin edges and the bin index of every row (-1 where the score is missing).
+    """
+    houses = df["Hogwarts House"].astype("category")
+    grids = {
+        "houses": houses.cat.codes.to_numpy().astype(np.intp),
+        "names": list(houses.cat.categories),
+        "bins": bins,
+        "courses": {},
+    }
+    for course in courses:
+        values = df[course].to_numpy(dtype=float)
+        present = ~np.isnan(values)
+        low, high = (values[present].min(), values[present].max()) if present.any() else (0.0, 1.0)
+        high = high if high > low else low + 1
+        index = np.full(len(values), -1, dtype=np.intp)
+        index[present] = np.minimum(((values[present] - low) / (high - low) * bins).astype(np.intp), bins - 1)
+        grids["courses"][course] = (np.linspace(low, high, bins + 1), index)
+    return grids
+
+
+def density_2d(grids, x_course, y_course):
+    # One bincount over (house, y bin, x bin) gives the 2D histogram of every house
+    bins, houses = grids["bins"], grids["houses"]
+    x, y = grids["courses"][x_course][1], grids["courses"][y_course][1]
+    valid = (x >= 0) & (y >= 0) & (houses >= 0)
+    flat = (houses[valid] * bins + y[valid]) * bins + x[valid]
+    return np.bincount(flat, minlength=len(grids["names"]) * bins * bins).reshape(-1, bins, bins)
+
+
+def density_1d(grids, course):
+    bins, houses = grids["bins"], grids["houses"]
+    x = grids["courses"][course][1]
+    valid = (x >= 0) & (houses >= 0)
+    return np.bincount(houses[valid] * bins + x[valid], minlength=len(grids["names"]) * bins).reshape(-1, bins)
+
+
+def density_image(grids, counts):
+    # Every house is a layer in its color, its opacity growing with the log of its count.
+    # The layers are composited here so matplotlib resamples a single image.
+    scale = np.log1p(counts.max()) or 1
+    color, alpha = np.zeros(counts.shape[1:] + (3,)), np.zeros(counts.shape[1:])
+    for name, house_counts in zip(grids["names"], counts):
+        layer = np.log1p(house_counts) / scale
+        color = np.multiply.outer(layer, to_rgb(HOUSE_COLORS[name])) + color * (1 - layer)[..., None]
+        alpha = layer + alpha * (1 - layer)
+
+    image = np.zeros(counts.shape[1:] + (4,))
+    np.divide(color, alpha[..., None], out=image[..., :3], where=alpha[..., None] > 0)
+    image[..., 3] = alpha
+    return image
+
+
+def density_extent(grids, x_course, y_course):
+    x_edges, y_edges = grids["courses"][x_course][0], grids["courses"][y_course][0]
+    return x_edges[0], x_edges[-1], y_edges[0], y_edges[-1]
+
+
+def draw_density(ax, grids, counts, x_course, y_course):
+    return ax.imshow(
+        density_image(grids, counts),
+        origin="lower",
+        extent=density_extent(grids, x_course, y_course),
+        aspect="auto",
+        interpolation="nearest",
+    )
+
+
+def draw_stacked_histogram(ax, grids, counts, course):
+    edges = grids["courses"][course][0]
+    bottom = np.zeros(counts.shape[1])
+    for name, house_counts in zip(grids["names"], counts):
+        ax.stairs(bottom + house_counts, edges, baseline=bottom, fill=True, color=HOUSE_COLORS[name], label=name)
+        bottom = bottom + house_counts
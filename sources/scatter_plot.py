@@ -7,14 +7,30 @@ from utils import (
     HOUSE_COLORS,
     DEFAULT_LOCATION_DATASET_TRAIN,
 )
+from rendering import (
+    render_parallel,
+    report_timing,
+    interactive,
+    stratified_sample,
+    reuse_canvas,
+    bin_courses,
+    density_2d,
+    density_image,
+    density_extent,
+    DEFAULT_DENSITY_BINS,
+)
+from analysis import rank_pairs
 from matplotlib import pyplot as plt
-import seaborn as sns
+from matplotlib.colors import to_rgba
+from matplotlib.lines import Line2D
+from matplotlib.patches import Patch
+import numpy as np
 import signal
+import time
 import os
 
 
 DEFAULT_LOCATION_IMAGES = "scatterplots"
-MOST_SIMILAR_FEATURES = ("Astronomy", "Defense Against the Dark Arts")
 
 
 def parse_args():
@@ -27,7 +43,7 @@ def parse_args():
         "--path",
         type=str,
         default=DEFAULT_LOCATION_DATASET_TRAIN,
-        help=f"Path to the input CSV dataset. Defaults to '{DEFAULT_LOCATION_DATASET_TRAIN}' if not specified.",
+        help=f"Path to the input CSV dataset, or a directory or glob of shards. Defaults to '{DEFAULT_LOCATION_DATASET_TRAIN}' if not specified.",
     )
 
     parser.add_argument(
@@ -49,9 +65,133 @@ def parse_args():
         help=f"Folder location of scatter plots png files. Defaults to '{DEFAULT_LOCATION_DATASET_TRAIN}' if not specified.",
     )
 
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes saving the scatter plots, rendered with the non-interactive Agg backend.",
+    )
+
+    parser.add_argument(
+        "--density",
+        action="store_true",
+        help="Draw every house as a 2D histogram instead of one point per student, for large datasets.",
+    )
+
+    parser.add_argument(
+        "--bins",
+        type=int,
+        default=DEFAULT_DENSITY_BINS,
+        help=f"Bins per axis with --density. Defaults to {DEFAULT_DENSITY_BINS}.",
+    )
+
+    parser.add_argument(
+        "--sample",
+        type=int,
+        help="Plot about this many students, sampled from every house in proportion to its size.",
+    )
+
+    parser.add_argument(
+        "--top",
+        type=int,
+        help="Only plot this many pairs of courses, the most correlated first.",
+    )
+
     return parser.parse_args()
 
 
+def set_titles(ax, first_course, second_course):
+    ax.set_title(f"Scatter plot of {first_course} against {second_course} Scores by Hogwarts House")
+    ax.set_xlabel(f"{first_course} Scores")
+    ax.set_ylabel(f"{second_course} Scores")
+
+
+class ScatterCanvas:
+    """One figure whose points are moved for every pair of courses, drawn as sns.scatterplot did."""
+
+    def __init__(self, df):
+        self.data = df
+        houses = df["Hogwarts House"].astype("category")
+        colors = np.array([to_rgba(HOUSE_COLORS[name]) for name in houses.cat.categories])
+        size = plt.rcParams["lines.markersize"] ** 2
+        linewidth = 0.08 * np.sqrt(size)
+
+        self.figure = plt.figure("Scatter plot", figsize=(10, 6))
+        self.ax = self.figure.gca()
+        self.points = self.ax.scatter(
+            np.zeros(len(df)), np.zeros(len(df)), s=size, edgecolor="w", linewidth=linewidth
+        )
+        self.points.set_facecolors(colors[houses.cat.codes.to_numpy()])
+        self.ax.legend(
+            handles=[
+                Line2D(
+                    [],
+                    [],
+                    linestyle="",
+                    marker="o",
+                    markersize=np.sqrt(size),
+                    markerfacecolor=color,
+                    markeredgecolor="w",
+                    markeredgewidth=linewidth,
+                    label=name,
+                )
+                for name, color in zip(houses.cat.categories, colors)
+            ],
+            title="Hogwarts House",
+        )
+
+    def draw(self, first_course, second_course):
+        # Students missing either score are masked out, not drawn
+        offsets = np.ma.masked_invalid(self.data[[first_course, second_course]].to_numpy(dtype=float))
+        self.points.set_offsets(offsets)
+        self.ax.ignore_existing_data_limits = True
+        self.ax.update_datalim(offsets.compressed().reshape(-1, 2))
+        self.ax.autoscale_view()
+        set_titles(self.ax, first_course, second_course)
+
+
+class DensityCanvas:
+    """One figure whose density image is replaced for every pair of courses."""
+
+    def __init__(self, grids):
+        self.data = grids
+        self.figure = plt.figure("Scatter plot", figsize=(10, 6))
+        self.ax = self.figure.gca()
+        self.image = self.ax.imshow(
+            np.zeros((grids["bins"], grids["bins"], 4)), origin="lower", aspect="auto", interpolation="nearest"
+        )
+        self.ax.legend(
+            handles=[Patch(color=HOUSE_COLORS[name], label=name) for name in grids["names"]],
+            title="Hogwarts House",
+        )
+
+    def draw(self, first_course, second_course):
+        counts = density_2d(self.data, first_course, second_course)
+        self.image.set_data(density_image(self.data, counts))
+        self.image.set_extent(density_extent(self.data, first_course, second_course))
+        set_titles(self.ax, first_course, second_course)
+
+
+# The data is the parsed frame, or its grids with --density
+CANVASES = {False: ScatterCanvas, True: DensityCanvas}
+
+
+def plot_scatter(data, first_course, second_course, density=False):
+    canvas = reuse_canvas(CANVASES[density], data)
+    canvas.draw(first_course, second_course)
+    return canvas.figure
+
+
+def scatter_path(save_folder, first_course, second_course):
+    return f"{save_folder}/scatterplot_{first_course.lower()}_{second_course.lower()}.png"
+
+
+def save_scatter(data, first_course, second_course, save_folder, density=False):
+    plot_scatter(data, first_course, second_course, density).savefig(
+        scatter_path(save_folder, first_course, second_course)
+    )
+
+
 def main():
     args = parse_args()
 
@@ -64,35 +204,46 @@ def main():
             lambda *_: (print("\033[2Ddslr: CTRL+C sent by user."), exit(1)),
         )
 
-        df = parse_csv(args.path)
-
-        for first_course, second_course in combinations(sorted(AVAILABLE_COURSES), r=2):
-            if args.save or args.show or (first_course, second_course) == MOST_SIMILAR_FEATURES:
-                plt.figure("Scatter plot", figsize=(10, 6))
-                sns.scatterplot(
-                    data=df,
-                    x=df[first_course],
-                    y=df[second_course],
-                    hue="Hogwarts House",
-                    palette=HOUSE_COLORS,
-                )
+        df = parse_csv(args.path, columns=["Hogwarts House"] + AVAILABLE_COURSES)
+        # The most correlated pair answers the subject, it is always shown
+        ranked = [pair for pair, _ in rank_pairs(df)]
+        most_similar = ranked[0]
+        pairs = ranked[: args.top] if args.top else list(combinations(sorted(AVAILABLE_COURSES), r=2))
+        if args.sample:
+            df = stratified_sample(df, args.sample)
+        # With --density every course is binned once, the plots only count bin indices
+        data = bin_courses(df, AVAILABLE_COURSES, args.bins) if args.density else df
 
-                plt.title(
-                    f"Scatter plot of {first_course} against {second_course} Scores by Hogwarts House"
-                )
-                plt.xlabel(f"{first_course} Scores")
-                plt.ylabel(f"{second_course} Scores")
+        if args.save and args.jobs > 1:
+            os.makedirs(args.save_folder, exist_ok=True)
+            start = time.perf_counter()
+            tasks = [
+                (f"{first} / {second}", first, second, args.save_folder, args.density) for first, second in pairs
+            ]
+            times = render_parallel(save_scatter, tasks, data, args.jobs)
+            report_timing(times, time.perf_counter() - start, args.jobs)
+
+            if interactive():
+                for first_course, second_course in pairs if args.show else [most_similar]:
+                    plot_scatter(data, first_course, second_course, args.density)
+                    plt.show()
+            return
+
+        start, times = time.perf_counter(), []
+        for first_course, second_course in pairs:
+            if args.save or args.show or (first_course, second_course) == most_similar:
+                rendered = time.perf_counter()
+                figure = plot_scatter(data, first_course, second_course, args.density)
 
                 if args.save:
                     if not os.path.exists(args.save_folder):
                         os.makedirs(args.save_folder)
-                    plt.savefig(
-                        f"{args.save_folder}/scatterplot_{first_course.lower()}_{second_course.lower()}.png"
-                    )
-                if args.show or (first_course, second_course) == MOST_SIMILAR_FEATURES:
+                    figure.savefig(scatter_path(args.save_folder, first_course, second_course))
+                    times.append(time.perf_counter() - rendered)
+                    print(f"[{len(times)}/{len(pairs)}] {first_course} / {second_course} ({times[-1]:.2f}s)")
+                if args.show or (first_course, second_course) == most_similar:
                     plt.show()
-                else:
-                    plt.close()
+        report_timing(times, time.perf_counter() - start, 1)
 
     except FileNotFoundError:
         print(f"Error: File '{args.path}' not found.")
@@ -0,0 +1,282 @@
+from concurrent.futures import Future
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logreg_predict import load_model_file, preprocess, predict_probabilities, LEGACY_LABELS
+from model import ModelFormatError
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import socketserver
+import threading
+import queue
+import json
+import time
+import csv
+import io
+import os
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+DEFAULT_MAX_BATCH_SIZE = 256
+DEFAULT_MAX_WAIT_MS = 5.0
+LATENCY_WINDOW = 10_000
+# Connections waiting to be accepted, bursts of concurrent clients are expected
+REQUEST_QUEUE_SIZE = 1024
+
+
+class RequestError(Exception):
+    pass
+
+
+def load_serving_model(model_file):
+    model_data = load_model_file(model_file)
+    if model_data.get("preprocessing") is None:
+        raise ModelFormatError("Serving needs a model saved with its preprocessing, retrain the model.")
+
+    return {
+        "features": list(model_data["preprocessing"]["features"]),
+        "preprocessing": model_data["preprocessing"],
+        "weights": model_data["weights"],
+        "biases": model_data["biases"],
+        "mode": model_data.get("mode", "ovr"),
+        "labels": np.asarray(model_data.get("labels", LEGACY_LABELS)),
+    }
+
+
+class MicroBatcher:
+    """Group the rows of concurrent requests so every batch is scored by one matrix product."""
+
+    def __init__(self, model_file, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        self.model_file = model_file
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.model = load_serving_model(model_file)
+        self.model_mtime = os.stat(model_file).st_mtime_ns
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.counters = {"requests": 0, "rows": 0, "batches": 0, "errors": 0, "reloads": 0}
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, X):
+        future = Future()
+        self.requests.put((X, future))
+        return future
+
+    def record(self, latency, rows=0, error=False):
+        with self.lock:
+            self.counters["requests"] += 1
+            self.counters["rows"] += rows
+            self.counters["errors"] += error
+            self.latencies.append(latency)
+
+    def stats(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            counters = dict(self.counters)
+        percentiles = {}
+        if latencies.size:
+            percentiles = {
+                f"p{percent}": float(value)
+                for percent, value in zip((50, 90, 99), np.percentile(latencies, [50, 90, 99]))
+            }
+            percentiles["max"] = float(latencies.max())
+        return {**counters, "latency_ms": percentiles, "model_file": self.model_file}
+
+    def reload_if_changed(self):
+        try:
+            mtime = os.stat(self.model_file).st_mtime_ns
+            if mtime == self.model_mtime:
+                return
+            model = load_serving_model(self.model_file)
+            # Written again while loading, the next check picks up the finished file
+            if os.stat(self.model_file).st_mtime_ns != mtime:
+                return
+            self.model, self.model_mtime = model, mtime
+            with self.lock:
+                self.counters["reloads"] += 1
+            print(f"Model reloaded from {self.model_file}")
+        except Exception as ex:
+            # A model being rewritten may be unreadable for a moment, keep serving the previous one
+            print(f"Model reload failed, keeping the previous model: {ex}")
+
+    def next_batch(self):
+        batch = [self.requests.get()]
+        rows = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+            rows += len(batch[-1][0])
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            self.reload_if_changed()
+            model = self.model
+
+            try:
+                X = preprocess(np.vstack([X for X, _ in batch]), model["preprocessing"])
+                probabilities = predict_probabilities(X, model["weights"], model["biases"], model["mode"])
+            except Exception as ex:
+                for _, future in batch:
+                    future.set_exception(ex)
+                continue
+
+            with self.lock:
+                self.counters["batches"] += 1
+            houses = np.take(model["labels"], np.argmax(probabilities, axis=1))
+            offsets = np.cumsum([len(X) for X, _ in batch])[:-1]
+            for (_, future), chunk_houses, chunk_probabilities in zip(
+                batch, np.split(houses, offsets), np.split(probabilities, offsets)
+            ):
+                future.set_result((model["labels"], chunk_houses, chunk_probabilities))
+
+
+def to_float(value):
+    if value is None or value == "":
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise RequestError(f"Invalid score {value!r}.")
+
+
+def parse_rows(body, content_type, features):
+    # Missing scores are allowed, they are imputed like in logreg_predict
+    if content_type.startswith("text/csv"):
+        try:
+            reader = csv.DictReader(io.StringIO(body.decode()))
+            missing = [feature for feature in features if feature not in (reader.fieldnames or [])]
+        except (UnicodeDecodeError, csv.Error) as ex:
+            raise RequestError(f"Invalid CSV: {ex}.")
+        # Other columns, like those of the dataset files, are ignored
+        if missing:
+            raise RequestError(f"Columns {missing} are missing from the CSV header.")
+        rows = [[to_float(row.get(feature)) for feature in features] for row in reader]
+    else:
+        try:
+            data = json.loads(body)
+        except (json.JSONDecodeError, UnicodeDecodeError) as ex:
+            raise RequestError(f"Invalid JSON: {ex}.")
+        if isinstance(data, dict):
+            if "rows" not in data:
+                raise RequestError("Expected a list of rows, or an object with a 'rows' list.")
+            data = data["rows"]
+        if not isinstance(data, list):
+            raise RequestError("Expected a list of rows.")
+        rows = [parse_json_row(row, features) for row in data]
+
+    if any(len(row) != len(features) for row in rows):
+        raise RequestError(f"Every row needs {len(features)} scores.")
+    return np.array(rows, dtype=float).reshape(len(rows), len(features))
+
+
+def parse_json_row(row, features):
+    if isinstance(row, dict):
+        # A misspelt course would otherwise be silently imputed as missing
+        unknown = [key for key in row if key not in features]
+        if unknown:
+            raise RequestError(f"Unknown fields {unknown}, expected some of {features}.")
+        return [to_float(row.get(feature)) for feature in features]
+    if isinstance(row, list):
+        return [to_float(value) for value in row]
+    raise RequestError(f"Invalid row {row!r}, expected an object or a list of {len(features)} scores.")
+
+
+def make_handler(batcher):
+    class PredictionHandler(BaseHTTPRequestHandler):
+        def address_string(self):
+            # Unix socket clients have no address
+            return str(self.client_address[0]) if self.client_address else "local"
+
+        def log_message(self, format, *args):
+            pass
+
+        def respond(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/stats":
+                self.respond(200, batcher.stats())
+            elif path == "/health":
+                self.respond(200, {"status": "ok"})
+            else:
+                self.respond(404, {"error": "Not found."})
+
+        def do_POST(self):
+            start = time.perf_counter()
+            url = urlparse(self.path)
+            if url.path != "/predict":
+                self.respond(404, {"error": "Not found."})
+                return
+
+            try:
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                X = parse_rows(body, self.headers.get("Content-Type", "application/json"), batcher.model["features"])
+                labels, houses, probabilities = batcher.submit(X).result()
+            except RequestError as ex:
+                batcher.record(time.perf_counter() - start, error=True)
+                self.respond(400, {"error": str(ex)})
+                return
+            except Exception as ex:
+                batcher.record(time.perf_counter() - start, error=True)
+                self.respond(500, {"error": str(ex)})
+                return
+
+            payload = {"houses": houses.tolist()}
+            if "probabilities" in parse_qs(url.query, keep_blank_values=True):
+                payload["probabilities"] = [dict(zip(labels.tolist(), row)) for row in probabilities.tolist()]
+            batcher.record(time.perf_counter() - start, rows=len(X))
+            self.respond(200, payload)
+
+    return PredictionHandler
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+
+class ThreadingTCPHTTPServer(ThreadingHTTPServer):
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+
+def serve(
+    model_file,
+    host=DEFAULT_HOST,
+    port=DEFAULT_PORT,
+    socket_path=None,
+    max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+    max_wait_ms=DEFAULT_MAX_WAIT_MS,
+):
+    batcher = MicroBatcher(model_file, max_batch_size, max_wait_ms)
+    handler = make_handler(batcher)
+
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, handler)
+        print(f"Serving {model_file} on unix socket {socket_path}")
+    else:
+        server = ThreadingTCPHTTPServer((host, port), handler)
+        print(f"Serving {model_file} on http://{host}:{port}")
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
@@ -0,0 +1,422 @@
+from utils import CSVValidationError, DEFAULT_LOCATION_DATASET_TRAIN
+from logreg_train import (
+    DEFAULT_LOCATION_MODEL,
+    DEFAULT_SEED,
+    DEFAULT_TOLERANCE,
+    OPTIMIZERS_BATCH_SIZE,
+    UPDATES,
+    SCHEDULES,
+    SOLVERS,
+    TRAINERS,
+    SHARED_ARRAYS,
+    binary_objective,
+    multinomial_objective,
+    gradient_descent_binary,
+    gradient_descent_multinomial,
+    share_array,
+    attach_shared_arrays,
+    load_training_data,
+    build_model_data,
+    write_model,
+)
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+import numpy as np
+import time
+import os
+
+
+DEFAULT_FOLDS = 5
+DEFAULT_TRIALS = 20
+DEFAULT_LEARNING_RATES = [0.001, 0.01, 0.1]
+DEFAULT_EPOCHS = [100, 500, 1_000]
+OPTIMIZERS = list(OPTIMIZERS_BATCH_SIZE)
+# The hyperparameters of a search path, every path is trained for increasing epochs
+PATH_KEYS = ("mode", "optimizer", "update", "schedule", "learning_rate")
+
+
+def parse_args():
+    parser = ArgumentParser(
+        prog="tune",
+        description="Search the training hyperparameters with stratified k-fold cross-validation, then retrain the best configuration on the whole dataset.",
+    )
+
+    parser.add_argument(
+        "--input-file",
+        type=str,
+        default=DEFAULT_LOCATION_DATASET_TRAIN,
+        help=f"Path to the input CSV dataset, or a directory or glob of shards. Defaults to '{DEFAULT_LOCATION_DATASET_TRAIN}' if not specified.",
+    )
+
+    parser.add_argument(
+        "--output_file",
+        type=str,
+        default=DEFAULT_LOCATION_MODEL,
+        help=f"Path to the model file of the best configuration. Files ending in '.pkl' use the legacy pickle format. Defaults to '{DEFAULT_LOCATION_MODEL}' if not specified.",
+    )
+
+    parser.add_argument(
+        "--search",
+        choices=["grid", "random"],
+        default="grid",
+        help="Try every combination of the values below ('grid'), or --trials combinations drawn at random, "
+        "the learning rate log-uniformly between the smallest and largest of --learning-rates ('random').",
+    )
+
+    parser.add_argument(
+        "--trials",
+        type=int,
+        default=DEFAULT_TRIALS,
+        help=f"Number of configurations drawn by the 'random' search. Defaults to {DEFAULT_TRIALS}.",
+    )
+
+    parser.add_argument(
+        "--learning-rates",
+        type=float,
+        nargs="+",
+        default=DEFAULT_LEARNING_RATES,
+        help=f"Learning rates to try, ignored by 'newton' and 'lbfgs'. Defaults to {DEFAULT_LEARNING_RATES}.",
+    )
+
+    parser.add_argument(
+        "--epochs",
+        type=int,
+        nargs="+",
+        default=DEFAULT_EPOCHS,
+        help=f"Numbers of epochs to try, the maximum number of iterations of 'newton' and 'lbfgs'. Defaults to {DEFAULT_EPOCHS}.",
+    )
+
+    parser.add_argument(
+        "--optimizers",
+        choices=OPTIMIZERS,
+        nargs="+",
+        default=["gd"],
+        help="Optimizers to try. Defaults to 'gd'.",
+    )
+
+    parser.add_argument(
+        "--updates",
+        choices=list(UPDATES),
+        nargs="+",
+        default=["plain"],
+        help="Update rules of 'gd', 'minibatch' and 'sgd' to try. Defaults to 'plain'.",
+    )
+
+    parser.add_argument(
+        "--schedules",
+        choices=list(SCHEDULES),
+        nargs="+",
+        default=["constant"],
+        help="Learning rate schedules to try. Defaults to 'constant'.",
+    )
+
+    parser.add_argument(
+        "--modes",
+        choices=list(TRAINERS),
+        nargs="+",
+        default=["ovr"],
+        help="Models to try. Defaults to 'ovr'.",
+    )
+
+    parser.add_argument(
+        "--folds",
+        type=int,
+        default=DEFAULT_FOLDS,
+        help=f"Number of cross-validation folds, every house is spread evenly over them. Defaults to {DEFAULT_FOLDS}.",
+    )
+
+    parser.add_argument(
+        "--tol",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help=f"Stop 'newton' and 'lbfgs' once the gradient norm or the loss change falls below this value. Defaults to {DEFAULT_TOLERANCE}.",
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=DEFAULT_SEED,
+        help=f"Seed of the folds, of the random search and of the batch shuffling. Defaults to {DEFAULT_SEED}.",
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Number of worker processes evaluating the folds. Defaults to the number of CPUs.",
+    )
+
+    args = parser.parse_args()
+    if args.folds < 2:
+        parser.error("--folds needs at least 2 folds.")
+    if min(args.epochs) < 1 or min(args.learning_rates) <= 0:
+        parser.error("--epochs and --learning-rates must be positive.")
+
+    return args
+
+
+def stratified_folds(y, folds, seed=None):
+    """Fold number of every row, the rows of every house dealt over the folds in a shuffled order."""
+    if folds > len(y):
+        raise ValueError(f"--folds {folds} is more than the {len(y)} rows, some folds would be empty.")
+    rng = np.random.default_rng(seed)
+    assignment = np.empty(len(y), dtype=np.intp)
+    dealt = 0
+    for label in np.unique(y):
+        rows = rng.permutation(np.flatnonzero(y == label))
+        # Every house continues the deal where the previous one stopped, so the folds differ by one row at most
+        assignment[rows] = (dealt + np.arange(len(rows))) % folds
+        dealt += len(rows)
+    return assignment
+
+
+def search_paths(args):
+    """Epochs to evaluate by search path, as a dict from the path's hyperparameters to sorted epochs."""
+    if args.search == "grid":
+        configurations = product(
+            args.modes, args.optimizers, args.updates, args.schedules, args.learning_rates, args.epochs
+        )
+    else:
+        rng = np.random.default_rng(args.seed)
+        low, high = np.log(min(args.learning_rates)), np.log(max(args.learning_rates))
+        configurations = [
+            (
+                rng.choice(args.modes),
+                rng.choice(args.optimizers),
+                rng.choice(args.updates),
+                rng.choice(args.schedules),
+                float(np.exp(rng.uniform(low, high))),
+                int(rng.choice(args.epochs)),
+            )
+            for _ in range(args.trials)
+        ]
+
+    paths = {}
+    for mode, optimizer, update, schedule, learning_rate, epochs in configurations:
+        if optimizer in SOLVERS:
+            # The solvers take no learning rate, update rule nor schedule
+            update, schedule, learning_rate = None, None, None
+        key = (str(mode), str(optimizer), update and str(update), schedule and str(schedule), learning_rate)
+        paths.setdefault(key, set()).add(int(epochs))
+    return {key: sorted(epochs) for key, epochs in paths.items()}
+
+
+def warm_starts(path):
+    # Plain steps at a constant rate carry no state but the parameters and the shuffling generator,
+    # training on from a model of fewer epochs gives exactly the model trained from scratch
+    return path["optimizer"] not in SOLVERS and path["update"] == "plain" and path["schedule"] == "constant"
+
+
+def fit(X, y, classes, path, epochs, tol, seed, model=None):
+    """Train the model of a search path over classes classes for epochs epochs, on from model or from zeros.
+
+    A model is the list of the parameters of its classifiers, one per class with 'ovr', along with
+    the generator shuffling their batches. Returns the model and whether every solver converged
+    before using up its epochs.
+    """
+    ovr = path["mode"] == "ovr"
+    targets = [(y == i).astype(np.int8) for i in range(classes)] if ovr else [np.eye(classes)[y]]
+
+    if path["optimizer"] in SOLVERS:
+        objective = binary_objective if ovr else multinomial_objective
+        size = X.shape[1] + 1 if ovr else (X.shape[1] + 1) * classes
+        model, converged = [], True
+        for target in targets:
+            theta, iterations, _ = SOLVERS[path["optimizer"]](*objective(X, target), np.zeros(size), epochs, tol)
+            model.append((theta,))
+            converged = converged and iterations < epochs
+        return model, converged
+
+    if model is None:
+        shape = (X.shape[1],) if ovr else (X.shape[1], classes)
+        bias = 0 if ovr else np.zeros(classes)
+        model = [(np.zeros(shape), bias, np.random.default_rng(seed)) for _ in targets]
+
+    descend = gradient_descent_binary if ovr else gradient_descent_multinomial
+    trained = []
+    for target, (weights, bias, rng) in zip(targets, model):
+        weights, bias = descend(
+            X,
+            target,
+            weights,
+            bias,
+            path["learning_rate"],
+            epochs,
+            OPTIMIZERS_BATCH_SIZE[path["optimizer"]](X),
+            update=path["update"],
+            schedule=SCHEDULES[path["schedule"]],
+            # A generator is passed on as is, warm starts keep shuffling where they stopped
+            seed=rng,
+        )
+        trained.append((weights, bias, rng))
+    return trained, False
+
+
+def predict(model, path, X):
+    if path["optimizer"] in SOLVERS:
+        if path["mode"] == "ovr":
+            weights = np.array([theta[:-1] for theta, in model])
+            biases = np.array([theta[-1] for theta, in model])
+        else:
+            theta = model[0][0].reshape(X.shape[1] + 1, -1)
+            weights, biases = theta[:-1].T, theta[-1]
+    elif path["mode"] == "ovr":
+        weights = np.array([weights for weights, *_ in model])
+        biases = np.array([bias for _, bias, _ in model], dtype=float)
+    else:
+        weights, biases = model[0][0].T, model[0][1]
+    return np.argmax(np.dot(X, weights.T) + biases, axis=1)
+
+
+def evaluate_path(key, epochs_path, fold, classes, tol, seed):
+    """Accuracy on one fold of the search path key after every number of epochs of epochs_path.
+
+    Returns (epochs, accuracy, training seconds) tuples, warm starting along the path when that
+    gives the same models as training from scratch.
+    """
+    path = dict(zip(PATH_KEYS, key))
+    X, y, folds = (SHARED_ARRAYS[name][1] for name in ("X", "y", "folds"))
+    train, test = np.flatnonzero(folds != fold), np.flatnonzero(folds == fold)
+    X_train, y_train, X_test, y_test = X[train], y[train], X[test], y[test]
+
+    results, model, converged, trained, elapsed = [], None, False, 0, 0.0
+    for epochs in epochs_path:
+        start = time.perf_counter()
+        if converged:
+            # The solvers stopped before their previous budget, more iterations give the same model
+            pass
+        elif model is not None and warm_starts(path):
+            model, _ = fit(X_train, y_train, classes, path, epochs - trained, tol, seed, model)
+        else:
+            model, converged = fit(X_train, y_train, classes, path, epochs, tol, seed)
+            elapsed = 0.0
+        elapsed += time.perf_counter() - start
+        trained = epochs
+        results.append((epochs, float(np.mean(predict(model, path, X_test) == y_test)), elapsed))
+    return results
+
+
+def cross_validate(X, y, classes, folds, paths, tol, seed, jobs):
+    """Mean and std accuracy and mean training time of every configuration, over every fold.
+
+    X, y and the fold assignment are placed once in shared memory, every task evaluates one
+    search path on one fold.
+    """
+    memories, specs = {}, {}
+    for name, array in (("X", X), ("y", y), ("folds", folds)):
+        memories[name], specs[name] = share_array(array)
+
+    accuracies, seconds = {}, {}
+    try:
+        with ProcessPoolExecutor(jobs, initializer=attach_shared_arrays, initargs=(specs,)) as executor:
+            futures = {
+                executor.submit(evaluate_path, key, epochs_path, fold, classes, tol, seed): (key, fold)
+                for key, epochs_path in paths.items()
+                for fold in range(folds.max() + 1)
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                key, fold = futures[future]
+                results = future.result()
+                label = " ".join(str(value) for value in key if value is not None)
+                print(f"[{done}/{len(futures)}] {label}, fold {fold + 1} ({results[-1][2]:.2f}s)")
+                for epochs, accuracy, elapsed in results:
+                    accuracies.setdefault(key + (epochs,), []).append(accuracy)
+                    seconds.setdefault(key + (epochs,), []).append(elapsed)
+    finally:
+        for memory in memories.values():
+            memory.close()
+            memory.unlink()
+
+    results = [
+        {
+            **dict(zip(PATH_KEYS + ("epochs",), configuration)),
+            "mean": float(np.mean(accuracies[configuration])),
+            "std": float(np.std(accuracies[configuration])),
+            "seconds": float(np.mean(seconds[configuration])),
+        }
+        for configuration in accuracies
+    ]
+    # The best accuracy first, the cheapest configuration first among equals
+    return sorted(results, key=lambda result: (-result["mean"], result["seconds"]))
+
+
+def format_results(results):
+    lines = [
+        f"{'rank':>4}  {'mode':<11}  {'optimizer':<9}  {'update':<8}  {'schedule':<12}  {'rate':>9}  {'epochs':>6}  "
+        f"{'accuracy':>8}  {'std':>6}  {'fit (s)':>7}"
+    ]
+    for rank, result in enumerate(results, start=1):
+        rate = "-" if result["learning_rate"] is None else f"{result['learning_rate']:.3g}"
+        lines.append(
+            f"{rank:>4}  {result['mode']:<11}  {result['optimizer']:<9}  {result['update'] or '-':<8}  "
+            f"{result['schedule'] or '-':<12}  {rate:>9}  {result['epochs']:>6}  "
+            f"{result['mean']:>8.4f}  {result['std']:>6.4f}  {result['seconds']:>7.3f}"
+        )
+    return "\n".join(lines)
+
+
+def retrain(X, y, labels, preprocessing, best, tol, seed, output_file):
+    # The same training as logreg_train with these options, on every row
+    optimizer = best["optimizer"]
+    update, schedule = best["update"] or "plain", best["schedule"] or "constant"
+    weights, biases, epochs = TRAINERS[best["mode"]](
+        X,
+        y,
+        labels,
+        best["learning_rate"],
+        best["epochs"],
+        OPTIMIZERS_BATCH_SIZE[optimizer](X),
+        optimizer=optimizer,
+        tol=tol,
+        update=update,
+        schedule=SCHEDULES[schedule],
+        seed=seed,
+    )
+    training = {
+        "optimizer": optimizer,
+        "learning_rate": best["learning_rate"],
+        "update": update,
+        "schedule": schedule,
+        "seed": seed,
+        "validation_split": 0.0,
+        "tol": tol,
+        "cross_validation_accuracy": best["mean"],
+    }
+    write_model(build_model_data(weights, biases, labels, best["mode"], epochs, preprocessing, training), output_file)
+
+
+def main():
+    args = parse_args()
+
+    try:
+        start = time.perf_counter()
+        # Parsed and standardized once, the folds only hold row numbers
+        X, y, labels, preprocessing = load_training_data(args.input_file)
+        folds = stratified_folds(y, args.folds, args.seed)
+        paths = search_paths(args)
+        jobs = args.jobs or os.cpu_count() or 1
+        configurations = sum(len(epochs) for epochs in paths.values())
+        print(
+            f"Evaluating {configurations} configurations along {len(paths)} paths on {args.folds} folds "
+            f"of {len(y)} rows with {jobs} job(s)"
+        )
+
+        results = cross_validate(X, y, len(labels), folds, paths, args.tol, args.seed, jobs)
+        print(format_results(results))
+        print(f"Cross-validation done in {time.perf_counter() - start:.2f}s")
+
+        best = results[0]
+        print(f"Retraining the best configuration on all {len(y)} rows")
+        retrain(X, y, labels, preprocessing, best, args.tol, args.seed, args.output_file)
+        print(f"Total wall time {time.perf_counter() - start:.2f}s")
+
+    except FileNotFoundError as ex:
+        print(f"Error: File '{ex.filename}' not found.")
+    except CSVValidationError as ex:
+        print(f"{ex.__class__.__name__}: {ex}")
+    except Exception as ex:
+        print(f"Unexpected error occured : {ex}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,15 @@
-import pandas as pd
+# pandas is imported by the functions needing it, so scripts only paying for
+# the lean csv reader below (e.g. logreg_predict) start quickly
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+import hashlib
+import errno
+import glob
+import json
+import csv
+import os
+import re
 
 
 DEFAULT_LOCATION_DATASET_TRAIN = "data/dataset_train.csv"
@@ -43,40 +54,73 @@ class DtypeMismatchError(CSVValidationError):
     pass
 
 
+EXPECTED_DTYPES = {
+    "Hogwarts House": object,
+    "First Name": object,
+    "Last Name": object,
+    "Birthday": "datetime64[ns]",
+    "Best Hand": object,
+    "Arithmancy": float,
+    "Astronomy": float,
+    "Herbology": float,
+    "Defense Against the Dark Arts": float,
+    "Divination": float,
+    "Muggle Studies": float,
+    "Ancient Runes": float,
+    "History of Magic": float,
+    "Transfiguration": float,
+    "Potions": float,
+    "Care of Magical Creatures": float,
+    "Charms": float,
+    "Flying": float,
+}
+
+# dtypes pushed down to read_csv when a caller asks for a subset of the columns
+PROJECTED_DTYPES = {
+    col: "category" if col in ("Hogwarts House", "Best Hand") else float
+    for col, dtype in EXPECTED_DTYPES.items()
+    if dtype is float or col in ("Hogwarts House", "Best Hand")
+}
+
+BEST_HANDS = ["Right", "Left"]
+# Values read_csv turns into NaN by default, the lean readers treat them as missing too
+MISSING_VALUES = frozenset(
+    ["", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN", "<NA>"]
+    + ["N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"]
+)
+VALID_HOUSES = ["Gryffindor", "Ravenclaw", "Slytherin", "Hufflepuff"]
+INTEGER = re.compile(r"^\s*[+-]?\d+\s*$")
+# Largest file read by the lean csv-module readers. Past it, parsing every value in Python
+# costs more time and memory than importing pandas saves, read_csv takes over.
+LEAN_READER_MAX_BYTES = 4 << 20
+
+# Index level naming the shard of each row when a directory or a glob is read
+SOURCE_LEVEL = "Source"
+
+# Opt-in: when set, parse_csv keeps the validated frame of every dataset it reads in this
+# directory as one .npy file per column (text columns as codes into a category list)
+DATASET_CACHE_ENV = "DSLR_CACHE_DIR"
+DATASET_CACHE_VERSION = 1
+DATASET_CACHE_BLOCK = 1 << 20
+
+
 def validate_csv_values(df, predict):
-    if not df["Best Hand"].isin(["Right", "Left"]).all():
+    if not df["Best Hand"].isin(BEST_HANDS).all():
         return False
 
     if predict:
         return True
 
-    if not df["Hogwarts House"].isin(["Gryffindor", "Ravenclaw", "Slytherin", "Hufflepuff"]).all():
+    if not df["Hogwarts House"].isin(VALID_HOUSES).all():
         return False
 
     return True
 
 
 def validate_csv_structure(df, predict):
-    expected_dtypes = {
-        "Hogwarts House": object,
-        "First Name": object,
-        "Last Name": object,
-        "Birthday": "datetime64[ns]",
-        "Best Hand": object,
-        "Arithmancy": float,
-        "Astronomy": float,
-        "Herbology": float,
-        "Defense Against the Dark Arts": float,
-        "Divination": float,
-        "Muggle Studies": float,
-        "Ancient Runes": float,
-        "History of Magic": float,
-        "Transfiguration": float,
-        "Potions": float,
-        "Care of Magical Creatures": float,
-        "Charms": float,
-        "Flying": float,
-    }
+    import pandas as pd
+
+    expected_dtypes = dict(EXPECTED_DTYPES)
 
     if predict:
         expected_dtypes.pop("Hogwarts House")
@@ -97,10 +141,352 @@ def validate_csv_structure(df, predict):
     return True
 
 
-def parse_csv(path, predict=False):
-    data = pd.read_csv(path, index_col="Index", parse_dates=["Birthday"], date_format="%Y-%m-%d")
+def prepare_csv(data, predict):
     if predict:
         data = data.drop(columns="Hogwarts House")
     validate_csv_structure(data, predict)
 
     return data if predict else data.dropna()
+
+
+def dataset_key(path):
+    # Size and mtime catch most edits, the digest catches rewrites preserving both
+    stat = os.stat(path)
+    digest = hashlib.blake2b()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(DATASET_CACHE_BLOCK), b""):
+            digest.update(block)
+    return {
+        "path": os.path.abspath(path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "digest": digest.hexdigest(),
+    }
+
+
+def dataset_cache_entry(cache_dir, key, predict, columns=None):
+    name = hashlib.sha256(key["path"].encode()).hexdigest()[:16]
+    if columns is not None:
+        name += "-" + hashlib.sha256("\0".join(columns).encode()).hexdigest()[:8]
+    return os.path.join(cache_dir, f"{name}-{'predict' if predict else 'train'}")
+
+
+def load_cached_dataset(entry, key):
+    try:
+        with open(os.path.join(entry, "meta.json")) as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if meta.get("version") != DATASET_CACHE_VERSION or meta.get("key") != key:
+        return None
+
+    import pandas as pd
+
+    try:
+        columns = {}
+        for i, spec in enumerate(meta["columns"]):
+            values = np.load(os.path.join(entry, f"{i}.npy"))
+            if spec.get("categorical"):
+                values = pd.Categorical.from_codes(values, spec["categories"])
+            elif spec["categories"] is not None:
+                # Code -1 (missing) picks the trailing NaN
+                values = np.array(spec["categories"] + [np.nan], dtype=object)[values]
+            columns[spec["name"]] = values
+        index = pd.Index(np.load(os.path.join(entry, "index.npy")), name=meta["index"])
+    except (OSError, ValueError):
+        return None
+
+    return pd.DataFrame(columns, index=index)
+
+
+def save_cached_dataset(entry, key, data):
+    import pandas as pd
+
+    try:
+        os.makedirs(entry, exist_ok=True)
+        meta_path = os.path.join(entry, "meta.json")
+        # The arrays are only trusted once meta.json is back in place
+        if os.path.exists(meta_path):
+            os.unlink(meta_path)
+
+        specs = []
+        for i, column in enumerate(data.columns):
+            values, categories = data[column].to_numpy(), None
+            categorical = isinstance(data[column].dtype, pd.CategoricalDtype)
+            if categorical:
+                values, categories = data[column].cat.codes.to_numpy(), data[column].cat.categories.tolist()
+            elif values.dtype == object:
+                values, uniques = pd.factorize(data[column])
+                categories = uniques.tolist()
+            np.save(os.path.join(entry, f"{i}.npy"), values, allow_pickle=False)
+            specs.append({"name": column, "categories": categories, "categorical": categorical})
+        np.save(os.path.join(entry, "index.npy"), data.index.to_numpy(), allow_pickle=False)
+
+        meta = {"version": DATASET_CACHE_VERSION, "key": key, "index": data.index.name, "columns": specs}
+        with open(meta_path + ".tmp", "w") as file:
+            json.dump(meta, file)
+        os.replace(meta_path + ".tmp", meta_path)
+    except (OSError, ValueError):
+        # A cache that cannot be written only costs the next run a parse
+        pass
+
+
+def projected_columns(path, columns, predict):
+    with open(path, newline="") as file:
+        header = next(csv.reader(file), [])
+    return select_columns(header, columns, predict)
+
+
+def select_columns(header, columns, predict):
+    columns = [col for col in columns if not (predict and col == "Hogwarts House")]
+    unknown = [col for col in columns if col not in EXPECTED_DTYPES]
+    missing = [col for col in ["Index"] + columns if col not in header]
+    if unknown:
+        raise ColumnMismatchError(f"Columns {unknown} are not part of the expected structure.")
+    if missing:
+        raise ColumnMismatchError(f"Columns {missing} are missing from the dataset.")
+    return columns
+
+
+def read_csv_options(columns):
+    if columns is None:
+        return {"parse_dates": ["Birthday"], "date_format": "%Y-%m-%d"}
+
+    options = {
+        "usecols": ["Index"] + columns,
+        "dtype": {col: PROJECTED_DTYPES[col] for col in columns if col in PROJECTED_DTYPES},
+    }
+    if "Birthday" in columns:
+        options.update(parse_dates=["Birthday"], date_format="%Y-%m-%d")
+    return options
+
+
+def validate_projected_columns(df, predict):
+    """Apply the rules of validate_csv_structure that concern the columns read."""
+    import pandas as pd
+
+    for col in df.columns:
+        if col in ("Best Hand", "Hogwarts House"):
+            allowed = BEST_HANDS if col == "Best Hand" else VALID_HOUSES
+            # Like isin() in validate_csv_values, a missing value (code -1) is not allowed either
+            if not set(df[col].cat.categories) <= set(allowed) or (df[col].cat.codes.to_numpy() < 0).any():
+                raise ValueValidationError("Invalid values found in 'Best Hand' or 'Hogwarts House'.")
+        elif col == "Birthday":
+            if not pd.api.types.is_dtype_equal(df[col].dtype, EXPECTED_DTYPES[col]):
+                raise ValueValidationError("Invalid 'Birthday' format, should be valid YYYY-MM-DD.")
+        elif EXPECTED_DTYPES[col] is object and not pd.api.types.is_object_dtype(df[col].dtype):
+            raise DtypeMismatchError(
+                f"Data type mismatch in column '{col}'. Expected {object}, found {df[col].dtype}."
+            )
+
+
+def prepare_projected_csv(data, columns, predict):
+    import pandas as pd
+
+    validate_projected_columns(data, predict)
+    data = data[columns] if predict else data[columns].dropna()
+
+    for col in data.select_dtypes(include="category"):
+        # Categories in order of appearance, as seaborn orders hues by them
+        codes = data[col].cat.codes.to_numpy()
+        categories = data[col].cat.categories[pd.unique(codes[codes >= 0])]
+        data[col] = data[col].cat.remove_unused_categories().cat.reorder_categories(categories)
+    return data
+
+
+def merge_moments(a, b):
+    """Chan et al. pairwise update of (count, mean, M2), the means and M2 being numbers or arrays of features."""
+    n_a, mean_a, m2_a = a
+    n_b, mean_b, m2_b = b
+    # An empty side may hold a NaN mean
+    if n_a == 0:
+        return b
+    if n_b == 0:
+        return a
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    return n, mean_a + delta * n_b / n, m2_a + m2_b + delta**2 * n_a * n_b / n
+
+
+def expand_paths(path):
+    """Return the CSV files a path stands for: itself, the *.csv files of a directory, or a glob's matches."""
+    if os.path.isdir(path):
+        paths = glob.glob(os.path.join(path, "*.csv"))
+    elif glob.has_magic(path):
+        paths = glob.glob(path)
+    else:
+        return [path]
+
+    if not paths:
+        raise FileNotFoundError(errno.ENOENT, "No CSV file found", path)
+    return sorted(paths)
+
+
+def read_shards(read, paths, jobs=None, **options):
+    # pandas' C parser releases the GIL while tokenizing and converting, so threads
+    # parse shards concurrently without pickling every frame back from a process
+    def read_shard(path):
+        try:
+            return read(path, **options)
+        except CSVValidationError as ex:
+            raise type(ex)(f"{path}: {ex}") from ex
+
+    with ThreadPoolExecutor(min(len(paths), jobs or os.cpu_count() or 1)) as executor:
+        return list(executor.map(read_shard, paths))
+
+
+def concat_shards(frames, paths):
+    import pandas as pd
+
+    # Shards each infer their own categories, align them or concat falls back to object
+    for col in frames[0].select_dtypes(include="category"):
+        categories = pd.unique(np.concatenate([frame[col].cat.categories.to_numpy() for frame in frames]))
+        for frame in frames:
+            frame[col] = frame[col].cat.set_categories(categories)
+
+    return pd.concat(frames, keys=paths, names=[SOURCE_LEVEL])
+
+
+def parse_csv(path, predict=False, columns=None, jobs=None):
+    """Read and validate a dataset.
+
+    With columns, only those are read, with their dtypes given to read_csv (courses as
+    float64, house and hand as category), and only the rules concerning them are checked.
+    A directory or a glob reads every shard with jobs threads, the frame is then indexed
+    by (Source, Index).
+    """
+    paths = expand_paths(path)
+    if len(paths) == 1:
+        return parse_csv_file(paths[0], predict, columns)
+    return concat_shards(read_shards(parse_csv_file, paths, jobs, predict=predict, columns=columns), paths)
+
+
+def parse_csv_file(path, predict=False, columns=None):
+    import pandas as pd
+
+    if columns is not None:
+        columns = projected_columns(path, list(columns), predict)
+
+    cache_dir = os.environ.get(DATASET_CACHE_ENV)
+    if cache_dir:
+        key = dataset_key(path)
+        entry = dataset_cache_entry(cache_dir, key, predict, columns)
+        data = load_cached_dataset(entry, key)
+        if data is not None:
+            return data
+
+    try:
+        data = pd.read_csv(path, index_col="Index", **read_csv_options(columns))
+    except ValueError as ex:
+        if columns is None:
+            raise
+        raise DtypeMismatchError(f"Data type mismatch: {ex}.")
+    data = prepare_csv(data, predict) if columns is None else prepare_projected_csv(data, columns, predict)
+
+    if cache_dir:
+        save_cached_dataset(entry, key, data)
+    return data
+
+
+def parse_csv_chunks(path, chunksize, predict=False, columns=None):
+    import pandas as pd
+
+    paths = expand_paths(path)
+    if len(paths) == 1:
+        yield from parse_csv_file_chunks(paths[0], chunksize, predict, columns)
+        return
+
+    # Shards are streamed one after the other, memory stays bound by chunksize
+    for shard in paths:
+        try:
+            for chunk in parse_csv_file_chunks(shard, chunksize, predict, columns):
+                yield pd.concat([chunk], keys=[shard], names=[SOURCE_LEVEL])
+        except CSVValidationError as ex:
+            raise type(ex)(f"{shard}: {ex}") from ex
+
+
+def parse_csv_file_chunks(path, chunksize, predict=False, columns=None):
+    import pandas as pd
+
+    if columns is not None:
+        columns = projected_columns(path, list(columns), predict)
+
+    chunks = pd.read_csv(path, index_col="Index", chunksize=chunksize, **read_csv_options(columns))
+    if columns is None:
+        for chunk in chunks:
+            yield prepare_csv(chunk, predict)
+        return
+
+    try:
+        for chunk in chunks:
+            yield prepare_projected_csv(chunk, columns, predict)
+    except ValueError as ex:
+        raise DtypeMismatchError(f"Data type mismatch: {ex}.")
+
+
+def parse_floats(values):
+    try:
+        values = ["nan" if value in MISSING_VALUES or not value.strip() else value for value in values]
+        return np.array(values).astype(float)
+    except ValueError:
+        return None
+
+
+def read_csv_columns(path, predict=False, columns=None):
+    """Read and validate a dataset with the csv module, applying the rules of validate_csv_structure.
+
+    Returns the 'Index' values and a dict of columns, the courses as float arrays.
+    Unlike parse_csv, rows with missing values are kept. With columns, only those are
+    parsed and checked, like parse_csv does.
+    """
+    with open(path, newline="") as file:
+        reader = csv.reader(file)
+        header = next(reader, [])
+        rows = list(reader)
+
+    expected_dtypes = dict(EXPECTED_DTYPES)
+    projected = columns is not None
+    if not projected:
+        if "Index" not in header or [column for column in header if column != "Index"] != list(EXPECTED_DTYPES):
+            raise ColumnMismatchError("Column names do not match the expected structure.")
+    else:
+        expected_dtypes = {col: EXPECTED_DTYPES[col] for col in select_columns(header, list(columns), predict)}
+    for line, row in enumerate(rows, start=2):
+        if len(row) != len(header):
+            raise ColumnMismatchError(f"Line {line} has {len(row)} fields, expected {len(header)}.")
+
+    positions = {col: header.index(col) for col in ["Index"] + list(expected_dtypes)}
+    values = {col: [row[i] for row in rows] for col, i in positions.items()}
+    if predict:
+        expected_dtypes.pop("Hogwarts House", None)
+
+    if ("Best Hand" in values and not set(values["Best Hand"]) <= set(BEST_HANDS)) or (
+        not predict and "Hogwarts House" in values and not set(values["Hogwarts House"]) <= set(VALID_HOUSES)
+    ):
+        raise ValueValidationError("Invalid values found in 'Best Hand' or 'Hogwarts House'.")
+
+    columns = {}
+    for col, dtype in expected_dtypes.items():
+        floats = parse_floats(values[col])
+        if dtype is float:
+            # pandas reads a column of integers without missing values as int64,
+            # unless float64 is pushed down to it as parse_csv does for a projection
+            if not projected and floats is not None and values[col] and all(INTEGER.match(value) for value in values[col]):
+                raise DtypeMismatchError(f"Data type mismatch in column '{col}'. Expected {dtype}, found int64.")
+            if floats is None:
+                raise DtypeMismatchError(f"Data type mismatch in column '{col}'. Expected {dtype}, found object.")
+            columns[col] = floats
+        elif col == "Birthday":
+            try:
+                for value in values[col]:
+                    if value not in MISSING_VALUES:
+                        datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                raise ValueValidationError("Invalid 'Birthday' format, should be valid YYYY-MM-DD.")
+            columns[col] = np.array(values[col], dtype=object)
+        else:
+            if floats is not None:
+                raise DtypeMismatchError(f"Data type mismatch in column '{col}'. Expected {dtype}, found float64.")
+            columns[col] = np.array(values[col], dtype=object)
+
+    return list(values["Index"]), columns
@@ -0,0 +1,231 @@
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+from utils import (
+    EXPECTED_DTYPES,
+    BEST_HANDS,
+    VALID_HOUSES,
+    MISSING_VALUES,
+    DEFAULT_LOCATION_DATASET_TRAIN,
+    expand_paths,
+)
+import pandas as pd
+import numpy as np
+import csv
+import os
+
+
+DEFAULT_CHUNKSIZE = 10_000
+DEFAULT_MAX_ERRORS = 10
+INTEGER_PATTERN = r"\s*[+-]?\d+\s*"
+DOMAINS = {"Best Hand": BEST_HANDS, "Hogwarts House": VALID_HOUSES}
+# Column wide rules, read_csv types a course of integers as int64 and a name of numbers as float64
+TYPED_COLUMNS = [col for col, dtype in EXPECTED_DTYPES.items() if col not in DOMAINS and col != "Birthday"]
+
+
+class Report:
+    """Offending rows per rule, counting them all but keeping only the first max_errors."""
+
+    def __init__(self, max_errors):
+        self.max_errors = max_errors
+        self.rules = {}
+
+    def add(self, rule, lines=(), indices=(), values=(), count=None):
+        entry = self.rules.setdefault(rule, {"count": 0, "rows": []})
+        entry["count"] += len(lines) if count is None else count
+        room = self.max_errors - len(entry["rows"])
+        if room > 0:
+            entry["rows"].extend(islice(zip(lines, indices, values), room))
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def format(self):
+        lines = []
+        for rule, entry in self.rules.items():
+            lines.append(f"{rule}: {entry['count']} row(s)" if entry["rows"] else rule)
+            for line, index, value in entry["rows"]:
+                lines.append(f"    line {line} (Index {index}): {value!r}")
+            if entry["count"] > len(entry["rows"]) and entry["rows"]:
+                lines.append(f"    ... {entry['count'] - len(entry['rows'])} more")
+        return "\n".join(lines)
+
+
+def check_header(header):
+    expected = ["Index"] + list(EXPECTED_DTYPES)
+    if header == expected:
+        return []
+
+    problems = []
+    missing = [col for col in expected if col not in header]
+    unknown = [col for col in header if col not in expected]
+    if missing:
+        problems.append(f"Missing columns: {missing}")
+    if unknown:
+        problems.append(f"Unknown columns: {unknown}")
+    if not missing and not unknown:
+        problems.append(f"Columns out of order, expected {expected}")
+    return problems
+
+
+def not_numbers(column):
+    # Cast straight away, only a column with a bad value pays for the slower elementwise pass
+    values = column.to_numpy()
+    try:
+        values[values != ""].astype(float)
+        return np.zeros(len(column), dtype=bool)
+    except ValueError:
+        missing = column.isin(MISSING_VALUES).to_numpy()
+        return pd.to_numeric(column.where(~missing), errors="coerce").isna().to_numpy() & ~missing
+
+
+def check_chunk(rows, first_line, header, predict, report, state):
+    lines = np.arange(first_line, first_line + len(rows))
+    lengths = np.fromiter(map(len, rows), dtype=np.intp, count=len(rows))
+    short = lengths != len(header)
+    if short.any():
+        report.add(
+            f"Wrong number of fields, expected {len(header)}",
+            lines[short],
+            [row[0] if row else "" for row, bad in zip(rows, short) if bad],
+            lengths[short].tolist(),
+        )
+        rows = [row for row, bad in zip(rows, short) if not bad]
+        lines = lines[~short]
+    if not rows:
+        return
+
+    values = pd.DataFrame(rows, columns=header, dtype=object)
+    index = values["Index"].to_numpy()
+
+    def flag(rule, bad, column):
+        bad = np.asarray(bad)
+        if bad.any():
+            report.add(rule, lines[bad], index[bad], values[column].to_numpy()[bad])
+
+    for col, dtype in EXPECTED_DTYPES.items():
+        column = values[col]
+
+        if col in DOMAINS:
+            if not (predict and col == "Hogwarts House"):
+                flag(f"'{col}' not in {DOMAINS[col]}", ~column.isin(DOMAINS[col]).to_numpy(), col)
+        elif col == "Birthday":
+            missing = column.isin(MISSING_VALUES).to_numpy()
+            dates = pd.to_datetime(column.where(~missing), format="%Y-%m-%d", errors="coerce")
+            flag("'Birthday' is not a valid YYYY-MM-DD date", dates.isna().to_numpy() & ~missing, col)
+        elif dtype is float:
+            flag(f"'{col}' is not a number", not_numbers(column), col)
+            if not state[col]:
+                state[col] = not column.str.fullmatch(INTEGER_PATTERN).all()
+        elif not state[col]:
+            state[col] = bool(not_numbers(column).any())
+
+
+def validate_csv(path, predict=False, chunksize=DEFAULT_CHUNKSIZE, max_errors=DEFAULT_MAX_ERRORS):
+    """Check a dataset against the rules of parse_csv, streaming it chunksize rows at a time.
+
+    Returns the number of rows read and a Report of every rule broken.
+    """
+    report = Report(max_errors)
+    with open(path, newline="") as file:
+        reader = csv.reader(file)
+        header = next(reader, [])
+        for problem in check_header(header):
+            report.add(problem, count=0)
+        if report:
+            return 0, report
+
+        # Whether a value told the column apart from what read_csv would infer, known after every chunk
+        state = {col: False for col in TYPED_COLUMNS}
+        rows = 0
+        while chunk := list(islice(reader, chunksize)):
+            # Line numbers assume one line per row, as in the exported datasets
+            check_chunk(chunk, rows + 2, header, predict, report, state)
+            rows += len(chunk)
+
+    for col in TYPED_COLUMNS:
+        if not state[col] and rows:
+            dtype = EXPECTED_DTYPES[col]
+            found = "int64" if dtype is float else "float64"
+            report.add(f"Data type mismatch in column '{col}'. Expected {dtype}, found {found}.", count=0)
+    return rows, report
+
+
+def validate_shards(paths, predict, chunksize, max_errors, jobs):
+    # The csv module holds the GIL, so shards are checked by worker processes
+    with ProcessPoolExecutor(min(jobs, len(paths))) as executor:
+        return list(executor.map(validate_csv, paths, repeat(predict), repeat(chunksize), repeat(max_errors)))
+
+
+def parse_args():
+    parser = ArgumentParser(
+        prog="validate",
+        description="Check a dataset before training or predicting, reporting every offending row.",
+    )
+
+    parser.add_argument(
+        "path",
+        type=str,
+        nargs="?",
+        default=DEFAULT_LOCATION_DATASET_TRAIN,
+        help=f"Path to the input CSV dataset, or a directory or glob of shards. Defaults to '{DEFAULT_LOCATION_DATASET_TRAIN}' if not specified.",
+    )
+
+    parser.add_argument(
+        "--predict",
+        action="store_true",
+        help="Validate a dataset to predict, whose 'Hogwarts House' column is ignored.",
+    )
+
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=DEFAULT_CHUNKSIZE,
+        help=f"Rows checked at a time, bounding memory. Defaults to {DEFAULT_CHUNKSIZE}.",
+    )
+
+    parser.add_argument(
+        "--max-errors",
+        type=int,
+        default=DEFAULT_MAX_ERRORS,
+        help=f"Offending rows listed per rule, all are counted. Defaults to {DEFAULT_MAX_ERRORS}.",
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Number of worker processes checking shards. Defaults to the number of CPUs.",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    try:
+        paths = expand_paths(args.path)
+        if len(paths) == 1:
+            results = [validate_csv(paths[0], args.predict, args.chunksize, args.max_errors)]
+        else:
+            jobs = args.jobs or os.cpu_count() or 1
+            results = validate_shards(paths, args.predict, args.chunksize, args.max_errors, jobs)
+    except FileNotFoundError as ex:
+        print(f"Error: File '{ex.filename}' not found.")
+        exit(1)
+    except Exception as ex:
+        print(f"Unexpected error occured : {ex}")
+        exit(1)
+
+    for path, (rows, report) in zip(paths, results):
+        if report:
+            print(f"{path}: invalid, {rows} rows read")
+            print(report.format())
+        else:
+            print(f"{path}: valid, {rows} rows")
+    if any(report for _, report in results):
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
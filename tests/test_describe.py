@@ -0,0 +1,58 @@
+from describe import QuantileSketch, DEFAULT_QUANTILE_ACCURACY
+import numpy as np
+import pytest
+
+
+SIZE = 100_000
+PERCENTS = (1, 10, 25, 50, 75, 90, 99)
+
+
+def orderings():
+    values = np.arange(1, SIZE + 1, dtype=float)
+    return {
+        "sorted": values,
+        "reverse-sorted": values[::-1].copy(),
+        "random": np.random.default_rng(42).permutation(values),
+    }
+
+
+def rank_errors(sketch, values):
+    ordered = np.sort(values)
+    estimates = sketch.quantiles(PERCENTS)
+    ranks = np.searchsorted(ordered, estimates) / (len(values) - 1)
+    return np.abs(ranks - np.array(PERCENTS) / 100)
+
+
+@pytest.mark.parametrize("ordering", ["sorted", "reverse-sorted", "random"])
+@pytest.mark.parametrize("chunksize", [100, 1_000, SIZE])
+def test_quantile_rank_error_is_bounded(ordering, chunksize):
+    values = orderings()[ordering]
+    sketch = QuantileSketch(DEFAULT_QUANTILE_ACCURACY)
+    for start in range(0, SIZE, chunksize):
+        sketch.update(values[start : start + chunksize])
+
+    assert rank_errors(sketch, values).max() <= DEFAULT_QUANTILE_ACCURACY
+
+
+@pytest.mark.parametrize("ordering", ["sorted", "reverse-sorted", "random"])
+def test_merged_quantile_rank_error_is_bounded(ordering):
+    values = orderings()[ordering]
+    sketch = QuantileSketch(DEFAULT_QUANTILE_ACCURACY)
+    for shard in np.array_split(values, 16):
+        other = QuantileSketch(DEFAULT_QUANTILE_ACCURACY)
+        for start in range(0, len(shard), 500):
+            other.update(shard[start : start + 500])
+        sketch.merge(other)
+
+    assert rank_errors(sketch, values).max() <= DEFAULT_QUANTILE_ACCURACY
+
+
+@pytest.mark.parametrize("ordering", ["sorted", "reverse-sorted", "random"])
+def test_centroid_weights_stay_within_the_median_cap(ordering):
+    values = orderings()[ordering]
+    sketch = QuantileSketch(DEFAULT_QUANTILE_ACCURACY)
+    for start in range(0, SIZE, 100):
+        sketch.update(values[start : start + 100])
+
+    assert sketch.weights.sum() == SIZE
+    assert sketch.weights.max() <= DEFAULT_QUANTILE_ACCURACY * SIZE